@@ -1,69 +1,602 @@
-import io
-
-# XML serialization library
-import dict2xml
-
-import httplib2
-import requests
-
-# Needed for Google negotiations.
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
+import functools
+import hmac
+import time
 
 # Flask dependencies.
-from flask import Flask, render_template, request, \
+from flask import Flask, Blueprint, render_template, request, current_app, \
     json, redirect, url_for, send_from_directory, jsonify, flash, \
-    send_file, get_flashed_messages
+    send_file, get_flashed_messages, Response, stream_with_context
+from jinja2 import Template
 
-# Sql Alchemy dependencies.
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.http import is_resource_modified
 
 # Application-specific helpers and libraries.
 from catalog_helpers import *
-from database_setup import Base, Category, CatalogItem
+from catalog_export import get_page_bounds, iter_catalog_rows, \
+    generate_json_catalog, generate_xml_catalog, generate_json_changes, \
+    format_json_change, buffer_chunks, join_document, CachedExport, \
+    EXPORT_ENCODINGS
+from database_setup import Category, CatalogItem, db_session, \
+    configure_engines
+from google_auth import GoogleUnavailable
+from image_processing import IMAGE_SIZES, ORIGINAL, variant_key
+from metrics import MetricsRegistry
+from services import CatalogServices, get_services, image_store, google, \
+    page_cache, export_cache, export_locks
+from session_store import create_session_store, ServerSessionInterface
+from uploads import UploadRequest
+
+# Routes and request hooks of the application, registered on applications
+# made by create_app.
+views = Blueprint('catalog', __name__)
+
+# Request metrics, exposed on /metrics.
+metrics = MetricsRegistry()
+request_duration = metrics.histogram(
+    'catalog_request_duration_seconds',
+    'Time taken to handle requests, including streaming the response.',
+    ['endpoint', 'method', 'status'])
+request_queries = metrics.histogram(
+    'catalog_request_queries',
+    'Number of SQL statements run per request.',
+    ['endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500))
+request_query_duration = metrics.histogram(
+    'catalog_request_query_duration_seconds',
+    'Time spent running SQL statements per request.',
+    ['endpoint'])
+template_render_duration = metrics.histogram(
+    'catalog_template_render_duration_seconds',
+    'Time taken to render templates.',
+    ['template'])
+serialization_duration = metrics.histogram(
+    'catalog_serialization_duration_seconds',
+    'Time spent rendering catalog exports, not counting SQL statements.',
+    ['format'])
+response_bytes = metrics.counter(
+    'catalog_response_bytes_total',
+    'Bytes sent in response bodies of known length.',
+    ['endpoint'])
+
+
+class TimedTemplate(Template):
+    """Jinja template recording how long it takes to render."""
+
+    def render(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            template_render_duration.observe(elapsed, template=self.name)
+            g.render_time = g.get('render_time', 0.0) + elapsed
+
+
+def create_app(config=None):
+    """Creates the catalog application. Settings are read from config.py
+    once, here; nothing is read from disk and no database connection is made
+    until a request needs it, so workers forked by a prefork server after
+    the application is created each open their own connections. The
+    database schema is created and upgraded separately, by
+    "python manage.py upgrade-db".
 
-app = Flask(__name__)
+    Args:
+        config: Mapping of settings overriding those of config.py.
 
-CLIENT_ID = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
-ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif']
+    Returns:
+        Flask application.
+    """
 
-# Connect to Database and create database session
-engine = create_engine('sqlite:///catalog.db')
-Base.metadata.bind = engine
+    app = Flask(__name__)
+    app.config.from_object('config')
+    if config is not None:
+        app.config.update(config)
 
-# Create database session.
-DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
+    configure_engines(app.config)
 
+    # Uploaded files are hashed as they are received and limited in size.
+    app.request_class = UploadRequest
 
-@app.route('/catalog.xml')
-def get_xml_catalog():
-    """Returns current catalog formatted to XML.
+    app.jinja_env.template_class = TimedTemplate
+
+    # Session contents are kept on the server; the cookie holds only an ID.
+    app.session_interface = ServerSessionInterface(
+        create_session_store(app.config))
+
+    app.extensions['catalog'] = CatalogServices(app.config)
+    app.register_blueprint(views)
+    app.teardown_appcontext(remove_db_session)
+
+    return app
+
+
+# Stands in for the sign-in state token in cached pages.
+STATE_PLACEHOLDER = '__SIGNIN_STATE__'
+
+
+def cached_for_anonymous(get_params=None):
+    """Returns decorator serving GET requests from visitors who aren't signed
+    in out of page_cache. Pages are cached by catalog version, path and the
+    query parameters the view reads, so a change made through any application
+    process is seen by all of them at once, and query strings the view
+    ignores don't fill the cache with copies of a page. The sign-in state
+    token, the only part of such pages that differs between visitors, is
+    replaced with STATE_PLACEHOLDER in cache and filled in on every request.
+
+    Args:
+        get_params: Function returning the view's query parameters, parsed
+                    and normalized as the view does; None if it reads none.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Signed-in users see their own navbar and item controls, and
+            # flashed messages are meant for one visitor only.
+            if request.method != 'GET' or session.get('logged_in') or \
+                    '_flashes' in session:
+                return view(*args, **kwargs)
+
+            key = (get_catalog_version().version, request.path,
+                   get_params() if get_params is not None else None)
+            page = page_cache.get(key)
+
+            if page is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+                page = response.get_data(as_text=True)
+                if 'state' in session:
+                    page = page.replace(session['state'], STATE_PLACEHOLDER)
+                page_cache.set(key, page)
+                return response
+
+            if STATE_PLACEHOLDER in page:
+                page = page.replace(STATE_PLACEHOLDER, get_signin_token())
+
+            return page
+
+        return wrapper
+
+    return decorator
+
+
+def read_only(view):
+    """Decorator for views that only read from the database, letting their
+    queries go to the read replica set by DATABASE_REPLICA_URI. Visitors who
+    wrote to the database within the last DATABASE_REPLICA_LAG seconds are
+    still served from the primary, so that they see their own changes.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Without a replica there is nothing to route, and the session isn't
+        # read, so responses don't vary by session cookie.
+        if not current_app.config['DATABASE_REPLICA_URI']:
+            return view(*args, **kwargs)
+
+        if session.get('primary_until', 0) <= time.time():
+            db_session.info['read_only'] = True
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@views.app_context_processor
+def inject_signin_state():
+    """Lets templates render the sign-in button's state token with
+    signin_state(), so a token is only issued to visitors who are actually
+    shown the button.
+    """
+
+    return {'signin_state': get_signin_token}
+
+
+def remove_db_session(exception=None):
+    """Discards current thread's database session at the end of each request,
+    rolling back anything the request left uncommitted.
     """
 
-    categories = db_session.query(Category).all()
-    root = {'category': [category.serialize for category in categories]}
-    xml = dict2xml.dict2xml(root, wrap="catalog", indent="  ")
+    db_session.remove()
 
-    response = make_response(xml)
-    response.headers['Content-Type'] = 'application/xml'
+
+@views.app_errorhandler(413)
+def reject_large_upload(error):
+    """Answers requests larger than the MAX_CONTENT_LENGTH setting."""
+
+    return upload_too_large()
+
+
+@views.before_app_request
+def start_request_timer():
+    g.request_started_at = time.time()
+
+
+@views.after_app_request
+def add_query_count_header(response):
+    """Reports number of SQL statements the request executed in the
+    "X-Query-Count" header, if enabled by the QUERY_COUNT_HEADER setting.
+    """
+
+    if current_app.config['QUERY_COUNT_HEADER']:
+        response.headers['X-Query-Count'] = str(get_query_count())
+
+    g.response_status = response.status_code
+    if response.content_length is not None:
+        response_bytes.inc(response.content_length,
+                           endpoint=request.endpoint or 'none')
 
     return response
 
 
-@app.route('/catalog.json')
+@views.after_app_request
+def stick_to_primary(response):
+    """Keeps a visitor whose request wrote to the database reading from the
+    primary while the replica catches up. See read_only().
+    """
+
+    if g.get('committed') and current_app.config['DATABASE_REPLICA_URI']:
+        session['primary_until'] = \
+            time.time() + current_app.config['DATABASE_REPLICA_LAG']
+
+    return response
+
+
+@views.teardown_app_request
+def record_request_metrics(exception=None):
+    """Records duration and SQL statements of the request in the request
+    metrics, and logs the request if it took longer than the
+    SLOW_REQUEST_THRESHOLD setting. Streamed responses are torn down once
+    streaming finishes, so their durations include streaming.
+    """
+
+    started_at = g.get('request_started_at')
+    if started_at is None:
+        return
+
+    duration = time.time() - started_at
+    endpoint = request.endpoint or 'none'
+    status = 500 if exception is not None else g.get('response_status', 500)
+
+    request_duration.observe(duration, endpoint=endpoint,
+                             method=request.method, status=status)
+    request_queries.observe(get_query_count(), endpoint=endpoint)
+    request_query_duration.observe(get_query_time(), endpoint=endpoint)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold and duration >= threshold:
+        queries = sorted(g.get('queries', []), reverse=True)
+        current_app.logger.warning(
+            'Slow request: %s %s took %.3f s; %d SQL statements took %.3f s '
+            'and templates %.3f s. Slowest statements:\n%s',
+            request.method, request.full_path.rstrip('?'), duration,
+            get_query_count(), get_query_time(), g.get('render_time', 0.0),
+            '\n'.join('  {0:.3f} s: {1}'.format(elapsed, statement)
+                      for elapsed, statement in queries[:5]))
+
+
+@views.route('/metrics')
+def show_metrics():
+    """Returns request metrics in the Prometheus text exposition format.
+    """
+
+    if not current_app.config['METRICS_ENABLED']:
+        return make_response('Not found.', 404)
+
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@views.route('/catalog.xml')
+@read_only
+def get_xml_catalog():
+    """Returns current catalog formatted to XML.
+    """
+
+    return export_catalog('.get_xml_catalog', generate_xml_catalog,
+                          'application/xml')
+
+
+@views.route('/catalog.json')
+@read_only
 def get_json_catalog():
     """Returns current catalog formatted to JSON.
     """
 
-    categories = db_session.query(Category).all()
+    return export_catalog('.get_json_catalog', generate_json_catalog,
+                          'application/json')
+
+
+def export_catalog(endpoint, generate, mimetype):
+    """Sends the catalog, or one page of it, to the client.
+
+    Responses carry the catalog version as ETag and the time of the latest
+    change as Last-Modified, so clients polling for changes are answered
+    with 304 after a single lookup of the version. The whole catalog and
+    pages of EXPORT_PAGE_SIZE categories are kept in export_cache once
+    rendered, until the catalog changes, and compressed in the coding picked
+    by the client's Accept-Encoding the first time it's asked for. Other
+    pages, exports larger than EXPORT_CACHE_MAX_BYTES, and all exports with
+    the cache disabled (EXPORT_CACHE_SIZE = 0) are streamed uncompressed as
+    they are rendered, so the document is never held in memory as a whole.
+
+    The optional "after" and "limit" query parameters select a page of
+    categories: only categories with an ID greater than "after" are
+    exported, at most "limit" of them. When more categories follow the
+    page, a "Link" header with rel="next" points to the next page.
+
+    Args:
+        endpoint: Name of the route being served, used to build "next" links.
+        generate: Generator function rendering catalog rows to a document.
+        mimetype: MIME type of the rendered document.
+
+    Returns:
+        HTTP response containing the catalog.
+    """
+
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return make_response('Limit must be a positive integer.', 400)
+
+    catalog_version = get_catalog_version()
+    key = (endpoint, after, limit)
+    cached = is_cached_export(key, catalog_version.version)
+    encoding = request.accept_encodings.best_match(
+        EXPORT_ENCODINGS, default='identity') if cached else 'identity'
+
+    # Each coding of the document is a different representation, so it needs
+    # an ETag of its own.
+    etag = '{0}-{1}'.format(catalog_version.version, encoding)
+
+    if not is_resource_modified(request.environ, etag=etag,
+                                last_modified=catalog_version.updated_at):
+        response = make_response('', 304)
+    else:
+        export = None
+        if cached:
+            export = get_cached_export(key, generate, mimetype,
+                                       catalog_version.version)
+
+        if export is not None and not export.too_large:
+            compressed = encoding not in export.bodies
+            response = Response(export.body(encoding), mimetype=mimetype)
+            if compressed and export_cache.get(key) is export:
+                # Store it again, so that the cache counts the new body
+                # towards EXPORT_CACHE_MAX_BYTES.
+                export_cache.set(key, export)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+            last_id, has_more = export.last_id, export.has_more
+        else:
+            encoding = 'identity'
+            etag = '{0}-{1}'.format(catalog_version.version, encoding)
+            last_id, has_more = get_page_bounds(db_session, after, limit)
+            rows = iter_catalog_rows(db_session, after=after, last_id=last_id)
+
+            chunks = timed_serialization(buffer_chunks(generate(rows)),
+                                         mimetype.split('/')[1])
+            response = Response(stream_with_context(chunks), mimetype=mimetype)
+
+        if has_more:
+            response.headers['Link'] = '<{0}>; rel="next"'.format(
+                url_for(endpoint, after=last_id, limit=limit))
+
+    response.set_etag(etag)
+    response.last_modified = catalog_version.updated_at
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def is_cached_export(key, version):
+    """Checks whether the export with the given key is served from
+    export_cache: the cache must be enabled, the export must be the whole
+    catalog or a page of EXPORT_PAGE_SIZE categories, and it mustn't be
+    known to be too large to keep at the given catalog version.
+    """
+
+    endpoint, after, limit = key
+    if export_cache.max_entries < 1:
+        return False
+    if limit != current_app.config['EXPORT_PAGE_SIZE'] and \
+            (limit is not None or after is not None):
+        return False
+
+    export = export_cache.get(key)
+    return export is None or export.version < version or not export.too_large
+
+
+def get_cached_export(key, generate, mimetype, version):
+    """Retrieves an export from export_cache, rendering it first if the cache
+    holds none at the given catalog version.
+
+    Args:
+        key: Tuple (endpoint, after, limit) identifying the export.
+        generate: Generator function rendering catalog rows to a document.
+        mimetype: MIME type of the rendered document.
+        version: Current catalog version.
+
+    Returns:
+        CachedExport of the requested page, without a document if the
+        document is larger than EXPORT_CACHE_MAX_BYTES.
+    """
+
+    export = export_cache.get(key)
+    if export is not None and export.version >= version:
+        return export
+
+    with export_locks.hold(key):
+        # Another request may have rendered it while this one waited.
+        export = export_cache.get(key)
+        if export is not None and export.version >= version:
+            return export
+
+        endpoint, after, limit = key
+        last_id, has_more = get_page_bounds(db_session, after, limit)
+        rows = iter_catalog_rows(db_session, after=after, last_id=last_id)
+        chunks = timed_serialization(buffer_chunks(generate(rows)),
+                                     mimetype.split('/')[1])
+        document = join_document(chunks, export_cache.max_size)
+
+        export = CachedExport(version, last_id, has_more, document)
+        export_cache.set(key, export)
+
+    return export
+
+
+def timed_serialization(chunks, format_name):
+    """Passes chunks of a rendered document through, recording the time spent
+    producing them less the time spent running SQL statements for them.
+    """
+
+    chunks = iter(chunks)
+    elapsed = 0.0
+
+    while True:
+        start, query_time = time.time(), get_query_time()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.time() - start - (get_query_time() - query_time)
+
+        yield chunk
+
+    serialization_duration.observe(elapsed, format=format_name)
+
+
+@views.route('/catalog/changes')
+@read_only
+def get_catalog_changes():
+    """Returns changes to categories and items made after the change whose
+    sequence number is given by the "since" query parameter, formatted to
+    JSON. Clients sync their copy of the catalog by applying the changes in
+    order and passing the "next" value of the response as "since" in their
+    next request. "limit" sets the number of changes per response (up to
+    CHANGES_MAX_PAGE_SIZE).
+
+    To start syncing, clients note "latest" from a request with since=0,
+    download /catalog.json, and then apply changes since the noted value.
+    Changes are idempotent, so applying one the download already reflects
+    is harmless. Once old changes are pruned from the log, requests for
+    changes since a pruned one are answered with 410, whose JSON body also
+    carries "latest", and clients start over in the same way.
+    """
+
+    since, error = get_changes_since()
+    if error is not None:
+        return error
+
+    limit = request.args.get('limit', current_app.config['CHANGES_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['CHANGES_MAX_PAGE_SIZE']))
 
-    return jsonify(catalog=[category.serialize for category in categories])
+    # Fetch one extra change to find out whether more follow.
+    changes = get_changes(since, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
 
+    return Response(generate_json_changes(
+        changes, changes[-1].seq if changes else since, has_more,
+        get_latest_change_seq()), mimetype='application/json')
 
-@app.route('/static/<path:path>')
+
+@views.route('/catalog/changes/stream')
+@read_only
+def stream_catalog_changes():
+    """Streams changes made after the "since" query parameter (or the
+    Last-Event-ID header of a reconnecting client) as Server-Sent Events,
+    polling for new ones every CHANGE_STREAM_POLL_INTERVAL seconds. Streams
+    end after CHANGE_STREAM_TIMEOUT seconds, upon which clients reconnect
+    and carry on from the last event they received.
+    """
+
+    if not current_app.config['CHANGE_STREAM_ENABLED']:
+        return make_response('Not found.', 404)
+
+    since, error = get_changes_since()
+    if error is not None:
+        return error
+
+    response = Response(stream_with_context(generate_change_events(since)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return response
+
+
+def get_changes_since():
+    """Reads the sequence number of the last change a client has seen from
+    the Last-Event-ID header or the "since" query parameter.
+
+    Returns:
+        Tuple (since, error). error is an HTTP response to send instead if
+        the parameter is invalid or changes after it were pruned from the
+        log.
+    """
+
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return None, make_response(
+            'Since must be a non-negative integer.', 400)
+
+    if since < get_catalog_version().pruned_seq:
+        message = 'Changes since {0} are no longer available; download ' \
+            '/catalog.json and sync from "latest" instead.'.format(since)
+        response = jsonify(error=message, latest=get_latest_change_seq())
+        response.status_code = 410
+        return None, response
+
+    return since, None
+
+
+def generate_change_events(since):
+    """Yields Server-Sent Events for changes made after since, waiting for
+    new changes until CHANGE_STREAM_TIMEOUT seconds have passed. A comment
+    is sent every 15 seconds without changes, so proxies keep the
+    connection open.
+    """
+
+    interval = current_app.config['CHANGE_STREAM_POLL_INTERVAL']
+    deadline = time.time() + current_app.config['CHANGE_STREAM_TIMEOUT']
+    last_sent = time.time()
+
+    yield 'retry: {0:d}\n\n'.format(int(interval * 1000))
+
+    while True:
+        changes = get_changes(since, current_app.config['CHANGES_MAX_PAGE_SIZE'])
+        for change in changes:
+            yield 'id: {0}\nevent: change\ndata: {1}\n\n'.format(
+                change.seq, format_json_change(change))
+            since = change.seq
+
+        # Ends the transaction, so that the next poll sees new changes and
+        # no connection is held while waiting.
+        db_session.rollback()
+
+        now = time.time()
+        if changes:
+            last_sent = now
+        elif now - last_sent >= 15:
+            yield ': keep-alive\n\n'
+            last_sent = now
+
+        if now >= deadline:
+            return
+
+        # A full page of changes means more may be waiting already.
+        if len(changes) < current_app.config['CHANGES_MAX_PAGE_SIZE']:
+            time.sleep(interval)
+
+
+@views.route('/static/<path:path>')
 def send_static(path):
     """Sends file from "static" directory.
 
@@ -77,51 +610,118 @@ def send_static(path):
     return send_from_directory('static', path)
 
 
-@app.route('/')
+@views.route('/')
+@read_only
+@cached_for_anonymous()
 def show_categories():
-    insert_signin_state()
-
-    # Retrieve list of items from database ordered by
-    # most recent 'created_at' date/time.
-    latest_items = db_session.query(CatalogItem) \
-        .order_by(CatalogItem.created_at.desc()) \
-        .limit(10)
-
     return render_template('categories.html',
-                           STATE=session['state'],
                            user=get_current_user_profile(),
                            category_summary=get_category_summary(),
-                           latest_items=latest_items)
+                           latest_items=get_latest_items())
+
 
+def get_category_page_params():
+    """Reads the ID of the last item on the previous page and the page size
+    from query parameters.
+
+    Returns:
+        Tuple (after, limit).
+    """
 
-@app.route('/category/<int:category_id>')
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', current_app.config['CATEGORY_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['CATEGORY_MAX_PAGE_SIZE']))
+
+    return after, limit
+
+
+@views.route('/category/<int:category_id>')
+@read_only
+@cached_for_anonymous(get_category_page_params)
 def show_category(category_id):
-    insert_signin_state()
-    try:
-        category = db_session.query(Category).filter_by(id=category_id).one()
-    except NoResultFound:
+    """Shows one page of a category's items. The optional "after" query
+    parameter is the ID of the last item on the previous page, and "limit"
+    sets the page size (up to CATEGORY_MAX_PAGE_SIZE).
+    """
+
+    category = get_category(category_id)
+    if category is None:
         return make_response('Category not found.', 404)
 
-    # Calculate item count for category retrieved above.
-    item_count = db_session.query(func.count(CatalogItem.id).label('item_count')) \
-        .filter_by(category_id=category.id) \
-        .one() \
-        .item_count
+    after, limit = get_category_page_params()
+    items, next_after = get_category_items(category_id, after, limit)
 
     return render_template('category.html',
-                           STATE=get_signin_token(),
                            user=get_current_user_profile(),
                            category=category,
-                           item_count=item_count,
+                           item_count=category.item_count,
+                           items=items,
+                           after=after,
+                           next_after=next_after,
+                           limit=limit,
                            category_summary=get_category_summary())
 
 
-@app.route('/category/<int:category_id>/create_item', methods=['GET', 'POST'])
-def create_item(category_id):
-    insert_signin_state()
+@views.route('/search')
+@read_only
+def search():
+    """Shows items whose name or description match the "q" query parameter,
+    best matches first. The "page" and "limit" query parameters select a page
+    of results.
+    """
+
+    terms, page, limit = get_search_params()
+    results, has_more = search_items(terms, page, limit)
+
+    return render_template('search.html',
+                           user=get_current_user_profile(),
+                           terms=terms,
+                           results=results,
+                           page=page,
+                           limit=limit,
+                           has_more=has_more,
+                           category_summary=get_category_summary())
+
+
+@views.route('/search.json')
+@read_only
+def search_json():
+    """Returns items matching the "q" query parameter formatted to JSON. Takes
+    the same parameters as the search page.
+    """
+
+    terms, page, limit = get_search_params()
+    results, has_more = search_items(terms, page, limit)
+
+    return jsonify(query=terms,
+                   page=page,
+                   next_page=page + 1 if has_more else None,
+                   results=[{'id': result.id,
+                             'name': result.name,
+                             'description': result.description,
+                             'category_id': result.category_id}
+                            for result in results])
 
+
+def get_search_params():
+    """Reads search string, page number and page size from query parameters.
+
+    Returns:
+        Tuple (terms, page, limit).
+    """
+
+    terms = request.args.get('q', '')
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE']))
+
+    return terms, page, limit
+
+
+@views.route('/category/<int:category_id>/create_item', methods=['GET', 'POST'])
+def create_item(category_id):
     # Check if user is logged in. If not, user is not authorized to create new items.
-    if not session['logged_in']:
+    if not session.get('logged_in'):
         return not_authorized()
 
     if request.method == 'GET':
@@ -130,7 +730,6 @@ def create_item(category_id):
         insert_csrf_token()
 
         return render_template('create_item.html',
-                               STATE=get_signin_token(),
                                csrf_token=get_csrf_token(),
                                user=get_current_user_profile(),
                                item=CatalogItem(),
@@ -162,7 +761,6 @@ def create_item(category_id):
                                description=request.form['description'])
 
             return render_template('create_item.html',
-                                   STATE=get_signin_token(),
                                    csrf_token=get_csrf_token(),
                                    user=get_current_user_profile(),
                                    item=item,
@@ -173,59 +771,58 @@ def create_item(category_id):
 
         new_item = CatalogItem(name=request.form['name'],
                                description=request.form['description'],
-                               category_id=request.form['category'],
+                               category_id=request.form.get('category', type=int),
                                user_id=user.id)
 
         image_file = request.files['image_file']
 
         # First check to see if form data contains image data.
         if image_file:
-            # ... then check to see if submitted image has valid extension.
-            file_extension = image_file.filename.lower().rsplit('.', 1)[1]
-            if file_extension not in ALLOWED_EXTENSIONS:
-                flash('Only image files (extensions jpg, jpeg, png, gif) are '
-                      'allowed for item images.', 'error')
+            # ... then store it if it is a JPEG, PNG or GIF image.
+            image_key = store_image(image_file)
+            if image_key is None:
+                flash('Only JPEG, PNG and GIF images are allowed for item '
+                      'images.', 'error')
 
-                # If extension was invalid, redirect user back to item creation
+                # If image was invalid, redirect user back to item creation
                 # form.
-                return redirect(url_for('create_item', category_id=category_id))
-            else:
-                new_item.image_blob = image_file.read()
+                return redirect(url_for('.create_item', category_id=category_id))
+
+            new_item.image_key = image_key
 
+        bump_catalog_version()
         db_session.add(new_item)
+        adjust_item_count(new_item.category_id, 1)
+        record_item_change(new_item)
         db_session.commit()
+        page_cache.clear()
 
         flash('"' + new_item.name + '" was successfully created!', 'success')
 
         # Item was accepted; redirect user to newly-created item's page.
-        return redirect(url_for('view_item', category_id=category_id,
+        return redirect(url_for('.view_item', category_id=category_id,
                                 item_id=new_item.id))
 
 
-@app.route('/view_item/<int:item_id>', methods=['GET'])
+@views.route('/view_item/<int:item_id>', methods=['GET'])
+@read_only
+@cached_for_anonymous()
 def view_item(item_id):
-    insert_signin_state()
-
-    try:
-        item = db_session.query(CatalogItem).filter_by(id=item_id).one()
-    except NoResultFound:
+    item = get_item(item_id)
+    if item is None:
         return item_not_found()
 
     return render_template('view_item.html',
-                           STATE=get_signin_token(),
                            user=get_current_user_profile(),
                            user_owns_item=user_owns_item(item_id),
                            item=item,
                            category_summary=get_category_summary())
 
 
-@app.route('/edit_item/<int:item_id>', methods=['GET', 'POST'])
+@views.route('/edit_item/<int:item_id>', methods=['GET', 'POST'])
 def edit_item(item_id):
-    insert_signin_state()
-
-    try:
-        item = db_session.query(CatalogItem).filter_by(id=item_id).one()
-    except NoResultFound:
+    item = get_item(item_id)
+    if item is None:
         return item_not_found()
 
     # Check user ownership of item.
@@ -237,7 +834,6 @@ def edit_item(item_id):
         insert_csrf_token()
 
         return render_template('edit_item.html',
-                               STATE=get_signin_token(),
                                csrf_token=get_csrf_token(),
                                user=get_current_user_profile(),
                                user_owns_item=user_owns_item(item_id),
@@ -252,9 +848,11 @@ def edit_item(item_id):
         if session['csrf_token'] != get_csrf_token():
             return bad_csrf_token()
 
+        old_category_id = item.category_id
+
         item.name = request.form['name']
         item.description = request.form['description']
-        item.category_id = request.form['category']
+        item.category_id = request.form.get('category', type=int)
 
         # Name, description, and category fields are required, so make sure they're
         # present before inserting any new items into the database.
@@ -270,7 +868,6 @@ def edit_item(item_id):
         # an explanation as to why the previously submitted form was rejected.
         if len(get_flashed_messages()) > 0:
             return render_template('edit_item.html',
-                                   STATE=get_signin_token(),
                                    csrf_token=get_csrf_token(),
                                    user=get_current_user_profile(),
                                    user_owns_item=user_owns_item(item_id),
@@ -278,52 +875,60 @@ def edit_item(item_id):
                                    category_summary=get_category_summary())
 
         image_file = request.files['image_file']
+        old_image_key = item.image_key
 
         # First check to see if form data contains image data.
         if image_file:
-            # ... then check to see if submitted image has valid extension.
-            file_extension = image_file.filename.lower().rsplit('.', 1)[1]
-            if file_extension not in ALLOWED_EXTENSIONS:
-                flash('Only image files (extensions jpg, jpeg, png, gif) are '
-                      'allowed for item images.', 'error')
+            # ... then store it if it is a JPEG, PNG or GIF image.
+            image_key = store_image(image_file)
+            if image_key is None:
+                flash('Only JPEG, PNG and GIF images are allowed for item '
+                      'images.', 'error')
 
-                # If extension was invalid, redirect user back to item creation
+                # If image was invalid, redirect user back to item editing
                 # form.
-                return redirect(url_for('edit_item', item_id=item.id))
-            else:
-                item.image_blob = image_file.read()
+                return redirect(url_for('.edit_item', item_id=item.id))
+
+            item.image_key = image_key
 
         # Check to see if "Delete image" checkbox was checked.
         if request.form.get('delete_image', False):
-            item.image_blob = None
+            item.image_key = None
 
+        bump_catalog_version()
         db_session.add(item)
+        if item.category_id != old_category_id:
+            adjust_item_count(old_category_id, -1)
+            adjust_item_count(item.category_id, 1)
+        record_item_change(item)
         db_session.commit()
+        page_cache.clear()
+
+        # Remove replaced or deleted image from the store if no other item
+        # uses it.
+        if old_image_key != item.image_key:
+            release_image(old_image_key)
 
         # User edit form was accepted.
         flash('"' + item.name + '" was successfully updated!', 'success')
-        return redirect(url_for('view_item', item_id=item_id))
+        return redirect(url_for('.view_item', item_id=item_id))
 
 
-@app.route('/delete_item/<int:item_id>', methods=['GET', 'POST'])
+@views.route('/delete_item/<int:item_id>', methods=['GET', 'POST'])
 def delete_item(item_id):
-    insert_signin_state()
+    item = get_item(item_id)
+    if item is None:
+        return item_not_found()
 
     # Check user ownership of item.
-    if not user_owns_item(item_id):
+    if not user_owns_item(item.id):
         return not_authorized()
 
-    try:
-        item = db_session.query(CatalogItem).filter_by(id=item_id).one()
-    except NoResultFound:
-        return item_not_found()
-
     if request.method == 'GET':
         # If user wants to delete item, insert new CSRF token.
         insert_csrf_token()
 
         return render_template('delete_item.html',
-                               STATE=get_signin_token(),
                                csrf_token=get_csrf_token(),
                                user=get_current_user_profile(),
                                category_id=item.category_id,
@@ -335,18 +940,79 @@ def delete_item(item_id):
         if request.form['csrf_token'] != get_csrf_token():
             return bad_csrf_token()
 
+        bump_catalog_version()
         db_session.query(CatalogItem).filter_by(id=item.id).delete()
+        adjust_item_count(item.category_id, -1)
+        record_item_change(item, deleted=True)
         db_session.commit()
+        page_cache.clear()
+
+        release_image(item.image_key)
 
         flash('"' + item.name + '" was successfully deleted!', 'success')
 
         # Token accepted, item deleted. Redirect user to category view.
-        return redirect(url_for('show_category', category_id=item.category_id))
+        return redirect(url_for('.show_category', category_id=item.category_id))
 
 
-@app.route('/item_image/<int:item_id>')
+@views.route('/catalog/items/batch', methods=['POST'])
+def batch_items():
+    """Creates, updates and deletes many items in one transaction, for tools
+    scripting changes to the catalog. Takes a JSON object whose
+    "operations" list is passed to apply_item_batch, up to
+    BATCH_MAX_OPERATIONS of them, and returns the result of each operation.
+    If any operation is invalid, nothing is applied and the response has
+    status 422.
+
+    Only JSON bodies are accepted, which browsers won't send to another site
+    without its consent, so the endpoint needs no CSRF token.
+    """
+
+    if not session.get('logged_in'):
+        return not_signed_in()
+
+    if not request.is_json:
+        return make_response('Request body must be JSON.', 415)
+
+    body = request.get_json(silent=True)
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return make_response(
+            'Request body must be an object with a list of "operations".', 400)
+
+    max_operations = current_app.config['BATCH_MAX_OPERATIONS']
+    if len(operations) > max_operations:
+        return make_response('At most {0} operations are accepted per '
+                             'request.'.format(max_operations), 400)
+
+    user = get_user(session['google_id'])
+    if user is None:
+        return not_signed_in()
+
+    results, applied = apply_item_batch(operations, user.id)
+    if applied:
+        page_cache.clear()
+
+    response = jsonify(applied=applied, results=results)
+    if not applied:
+        response.status_code = 422
+
+    return response
+
+
+@views.route('/item_image/<int:item_id>')
+@read_only
 def get_item_image(item_id):
-    """Retrieve image for item with id item_id from database blob.
+    """Retrieve image for item with id item_id from image store.
+
+    The "size" query parameter selects one of the resized variants in
+    IMAGE_SIZES; the original upload is sent by default, and also while a
+    variant is still being generated.
+
+    Responses carry the image's content hash as a strong ETag, so conditional
+    requests are answered with 304 without opening the image. When the "v"
+    query parameter matches the image's key the URL can never refer to
+    different content, and the response is marked as cacheable forever.
 
     Args:
         item_id: ID of item
@@ -356,14 +1022,61 @@ def get_item_image(item_id):
     """
 
     try:
-        item = db_session.query(CatalogItem).filter_by(id=item_id).one()
+        image_key = db_session.query(CatalogItem.image_key) \
+            .filter_by(id=item_id) \
+            .one() \
+            .image_key
     except NoResultFound:
         return item_not_found()
 
-    return send_file(io.BytesIO(item.image_blob))
+    size = request.args.get('size', ORIGINAL)
+    if size not in IMAGE_SIZES:
+        return make_response('Unknown image size.', 400)
+
+    if image_key is None:
+        return make_response('Image not found.', 404)
+
+    served_key = variant_key(image_key, size)
+    if not image_store.exists(served_key):
+        served_key = image_key
+
+        # The item may refer to an image that was lost or never copied over,
+        # as after importing a catalog without its images.
+        if not image_store.exists(served_key):
+            return make_response('Image not found.', 404)
+
+    last_modified = image_store.modified_at(served_key)
+
+    if is_resource_modified(request.environ, etag=served_key,
+                            last_modified=last_modified):
+        # Sending from a path lets the WSGI server use sendfile() instead of
+        # copying the image through Python.
+        image_path = image_store.path(served_key)
+        response = send_file(image_path or image_store.open(served_key),
+                             mimetype=image_store.content_type(served_key))
+    else:
+        response = make_response('', 304)
+
+    response.set_etag(served_key)
+    response.last_modified = last_modified
+    response.headers.pop('Expires', None)
+    response.cache_control.public = True
+
+    # A fallback to the original must not be cached in place of the variant.
+    if request.args.get('v') == image_key and \
+            served_key == variant_key(image_key, size):
+        response.cache_control.max_age = current_app.config['IMAGE_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # Unversioned URLs may point at a different image after an edit, so
+        # caches have to revalidate them on every use.
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+
+    return response
 
 
-@app.route('/gconnect', methods=['POST'])
+@views.route('/gconnect', methods=['POST'])
 def gconnect():
     """Goes through the process of authorizing web application to make requests from
     Google on user's behalf using OAuth2; enables application to access basic user
@@ -373,7 +1086,13 @@ def gconnect():
     https://developers.google.com/identity/protocols/OAuth2WebServer
     """
 
-    if request.args.get('state') != session['state']:
+    # A session without a state token, e.g. a new one or one whose token was
+    # used up by signing in, accepts no state at all.
+    expected_state = session.get('state')
+    state = request.args.get('state', '')
+    if not expected_state or \
+            not hmac.compare_digest(state.encode('utf-8'),
+                                    expected_state.encode('utf-8')):
         response = make_response(json.dumps('Invalid state parameter.'), 401)
         response.headers['Content-Type'] = 'application/json'
 
@@ -381,22 +1100,29 @@ def gconnect():
 
     code = request.data
 
+    # Needed for Google negotiations. Imported here, as only signing in needs
+    # oauth2client, which takes longer to import than the rest of the
+    # application's dependencies together.
+    from oauth2client.client import flow_from_clientsecrets
+    from oauth2client.client import FlowExchangeError
+
     try:
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
+        oauth_flow = flow_from_clientsecrets(current_app.config['CLIENT_SECRETS_FILE'],
+                                             scope='')
         oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = google.exchange_code(oauth_flow, code)
+        result, data = google.get_token_and_user_info(credentials.access_token)
     except FlowExchangeError:
         response = make_response(json.dumps('Failed to upgrade authorization code.'),
                                  401)
         response.headers['Content-Type'] = 'application/json'
 
         return response
+    except GoogleUnavailable:
+        response = make_response(json.dumps('Failed to reach Google.'), 503)
+        response.headers['Content-Type'] = 'application/json'
 
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+        return response
 
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
@@ -413,7 +1139,7 @@ def gconnect():
 
         return response
 
-    if result['issued_to'] != CLIENT_ID:
+    if result['issued_to'] != get_services().client_id:
         response = make_response(json.dumps("Token's client ID doesn't match app's."),
                                  401)
         response.headers['Content-Type'] = 'application/json'
@@ -428,24 +1154,21 @@ def gconnect():
 
         return response
 
-    session['gplus_id'] = gplus_id
-
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
+    user = save_user(google_id=data['id'], name=data['name'],
+                     email=data['email'], picture=data['picture'])
 
-    data = answer.json()
-
-    session['username'] = data['name']
-    session['picture'] = data['picture']
-    session['email'] = data['email']
+    # Profile details are looked up through get_user rather than kept in
+    # the session.
+    session.regenerate()
+    session['gplus_id'] = gplus_id
     session['google_id'] = data['id']
     session['logged_in'] = True
 
-    if not get_user(session['gplus_id']):
-        create_user(session)
+    # State token has served its purpose; a new one is issued the next time
+    # the sign-in button is shown.
+    session.pop('state', None)
 
-    return "Logged in as {0}".format(session.get('username'))
+    return "Logged in as {0}".format(user.username)
 
 
 def gdisconnect():
@@ -459,12 +1182,12 @@ def gdisconnect():
 
         return response
 
-    access_token = session['access_token']
-    url = 'https://accounts.google.com/o/oauth2/revoke?token={0}'.format(access_token)
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
+    try:
+        revoked = google.revoke_token(session['access_token'])
+    except GoogleUnavailable:
+        revoked = False
 
-    if result['status'] != '200':
+    if not revoked:
         # For whatever reason, the given token was invalid.
         response = make_response(
             json.dumps('Failed to revoke token for given user.'), 400)
@@ -473,26 +1196,24 @@ def gdisconnect():
         return response
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Log out of Google, delete associated session keys.
     """
     gdisconnect()
 
     del session['access_token']
-    del session['username']
-    del session['picture']
     del session['gplus_id']
-    del session['email']
     del session['google_id']
 
     session['logged_in'] = False
 
-    return redirect(url_for('show_categories'))
+    return redirect(url_for('.show_categories'))
 
 
 # Application startup
 if __name__ == '__main__':
+    app = create_app()
     app.secret_key = 'super_secret_key'
     app.debug = True
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
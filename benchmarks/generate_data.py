@@ -0,0 +1,137 @@
+"""Fills a catalog database and image store with synthetic users, categories,
+items and images for benchmarking. The same seed always produces the same
+data.
+
+Usage:
+    python benchmarks/generate_data.py [--database PATH] [--images PATH]
+                                       [--items N] [--seed N]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+WORDS = ['ball', 'bat', 'glove', 'helmet', 'racket', 'net', 'shoe', 'board',
+         'stick', 'goal', 'jersey', 'pad', 'rope', 'ski', 'pole', 'mask',
+         'red', 'blue', 'green', 'black', 'white', 'pro', 'junior', 'classic',
+         'light', 'heavy', 'carbon', 'leather', 'wooden', 'indoor', 'outdoor']
+
+
+def sentence(words):
+    return ' '.join(random.choice(WORDS) for _ in range(words))
+
+
+def generate_image(width=1200, height=900):
+    """Returns a JPEG of random shapes, big enough that resized variants are
+    noticeably smaller than the original."""
+
+    image = Image.new('RGB', (width, height), tuple(
+        random.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = random.randint(0, width), random.randint(0, height)
+        size = random.randint(20, width // 3)
+        draw.ellipse([x, y, x + size, y + size],
+                     fill=tuple(random.randint(0, 255) for _ in range(3)))
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=85)
+
+    return output.getvalue()
+
+
+def generate_records(categories, users, items, image_keys, image_ratio):
+    """Yields synthetic records in the format read by catalog_transfer."""
+
+    for user in range(1, users + 1):
+        yield {'type': 'user', 'google_id': 'user-{0}'.format(user),
+               'name': 'User {0}'.format(user),
+               'email': 'user{0}@example.com'.format(user),
+               'picture': 'https://example.com/user{0}.png'.format(user)}
+
+    for category in range(1, categories + 1):
+        yield {'type': 'category', 'id': category,
+               'name': 'Category {0}'.format(category)}
+
+    start = datetime(2015, 1, 1)
+    for item in range(1, items + 1):
+        record = {'type': 'item', 'id': item,
+                  'category_id': random.randint(1, categories),
+                  'name': sentence(3).capitalize(),
+                  'description': sentence(random.randint(10, 60)).capitalize(),
+                  'user': 'user-{0}'.format(random.randint(1, users)),
+                  'created_at': (start + timedelta(seconds=random.randint(
+                      0, 365 * 86400))).isoformat()}
+        if image_keys and random.random() < image_ratio:
+            record['image'] = random.choice(image_keys)
+
+        yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='bench.db',
+                        help='SQLite database file to fill.')
+    parser.add_argument('--images', default='bench_images',
+                        help='Directory of the image store to fill.')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--image-count', type=int, default=200,
+                        help='Number of distinct images, shared by items.')
+    parser.add_argument('--image-ratio', type=float, default=0.5,
+                        help='Fraction of items with an image.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for generated data.')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        sys.exit('{0} already exists.'.format(args.database))
+
+    # The database modules read DATABASE_URI when they're imported.
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.database)
+
+    from catalog_transfer import CatalogImporter
+    from database_setup import get_engine
+    from image_processing import generate_variants
+    from image_store import LocalImageStore
+    from manage import rebuild_category_counts, upgrade_db
+
+    random.seed(args.seed)
+    engine = get_engine()
+    upgrade_db(engine)
+
+    start = time.time()
+    image_store = LocalImageStore(args.images)
+    image_keys = []
+    for _ in range(args.image_count):
+        key = image_store.save(generate_image())
+        generate_variants(image_store, key)
+        image_keys.append(key)
+    print('Generated {0} images in {1:.1f} s.'.format(
+        len(image_keys), time.time() - start))
+
+    records = generate_records(args.categories, args.users, args.items,
+                               image_keys, args.image_ratio)
+    importer = CatalogImporter(engine, image_store)
+    for number, record in enumerate(records, 1):
+        importer.add(number, record)
+    importer.flush()
+    rebuild_category_counts(engine)
+
+    stats = importer.stats
+    print('Generated {0} users, {1} categories and {2} items in {3:.1f} s.'
+          .format(stats.users, stats.categories, stats.items,
+                  time.time() - stats.started_at))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Local stand-in for the Google endpoints used when signing in, so sign-in
+can be exercised and timed without a network connection or Google account.
+
+Every response is delayed by a fixed latency to mimic the round trip to
+Google. Any authorization code is accepted, and signs in the same fake user.
+
+Usage:
+    python benchmarks/google_stub.py [--port N] [--latency SECONDS]
+"""
+
+import argparse
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+
+CLIENT_ID = 'stub-client-id'
+ACCESS_TOKEN = 'stub-access-token'
+USER = {
+    'id': '100000000000000000001',
+    'name': 'Stub User',
+    'email': 'stub.user@example.com',
+    'picture': 'https://example.com/stub-user.png',
+}
+
+
+def encode_segment(data):
+    return base64.urlsafe_b64encode(
+        json.dumps(data).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+# oauth2client reads the user's ID from the token without checking its
+# signature, so the header and signature can be anything.
+ID_TOKEN = '.'.join([encode_segment({'alg': 'none'}),
+                     encode_segment({'sub': USER['id'], 'aud': CLIENT_ID}),
+                     'signature'])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/tokeninfo':
+            self.send_json({'issued_to': CLIENT_ID, 'audience': CLIENT_ID,
+                            'user_id': USER['id'], 'expires_in': 3600})
+        elif path == '/userinfo':
+            self.send_json(USER)
+        elif path == '/revoke':
+            self.send_json({})
+        else:
+            self.send_json({'error': 'not_found'}, 404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlparse(self.path).path == '/token':
+            self.send_json({'access_token': ACCESS_TOKEN,
+                            'token_type': 'Bearer', 'expires_in': 3600,
+                            'id_token': ID_TOKEN})
+        else:
+            self.send_json({'error': 'not_found'}, 404)
+
+    def send_json(self, data, status=200):
+        time.sleep(self.server.latency)
+
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGoogleServer(ThreadingMixIn, HTTPServer):
+    """Stub Google server answering each request on its own thread.
+
+    Can be used as a context manager, which serves requests on a background
+    thread until the block exits.
+
+    Attributes:
+        latency: Seconds by which every response is delayed.
+        url: Base URL of the server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.05):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def client_secrets(self):
+        """Returns contents of a client secrets file pointing at the stub."""
+
+        return {'web': {'client_id': CLIENT_ID,
+                        'client_secret': 'stub-client-secret',
+                        'auth_uri': self.url + '/auth',
+                        'token_uri': self.url + '/token',
+                        'redirect_uris': []}}
+
+    def config(self):
+        """Returns application settings pointing at the stub."""
+
+        return {'GOOGLE_TOKENINFO_URL': self.url + '/tokeninfo',
+                'GOOGLE_USERINFO_URL': self.url + '/userinfo',
+                'GOOGLE_REVOKE_URL': self.url + '/revoke'}
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the delayed response is sent.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8001,
+                        help='Port to listen on.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds by which every response is delayed.')
+    args = parser.parse_args()
+
+    server = StubGoogleServer(args.port, args.latency)
+    print('Serving stub Google endpoints at {0}'.format(server.url))
+    print('Client secrets:\n{0}'.format(
+        json.dumps(server.client_secrets(), indent=2)))
+    for name, value in sorted(server.config().items()):
+        print('{0}={1}'.format(name, value))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Load-tests the application's read-only routes and reports latency
+percentiles, throughput and peak memory use. Results are saved as JSON so runs
+can be compared.
+
+The application is started in a child process against a database filled by
+generate_data.py, and each route is hit in turn by a number of concurrent
+clients.
+
+Usage:
+    python benchmarks/load_test.py [--database PATH] [--images PATH]
+                                   [--requests N] [--concurrency N]
+                                   [--compare RESULTS.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from sqlalchemy import create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Routes under test, with a function picking the path of each request from
+# the category and item IDs in the database. Export routes render the whole
+# catalog, so they get fewer requests.
+ROUTES = [
+    ('home', False, lambda ids: '/'),
+    ('category', False, lambda ids: '/category/{0}'.format(
+        random.choice(ids['categories']))),
+    ('view_item', False, lambda ids: '/view_item/{0}'.format(
+        random.choice(ids['items']))),
+    ('item_image', False, lambda ids: '/item_image/{0}?size=thumbnail'.format(
+        random.choice(ids['images']))),
+    ('catalog_json', True, lambda ids: '/catalog.json'),
+    ('catalog_xml', True, lambda ids: '/catalog.xml'),
+]
+
+
+def serve(port):
+    """Runs the application on a multi-threaded server until killed."""
+
+    from werkzeug.serving import make_server
+
+    from application import create_app
+
+    app = create_app()
+    app.secret_key = 'load-test'
+
+    # Logging every request would slow the server down.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_server(args):
+    """Starts application in a child process and waits until it answers.
+
+    Returns:
+        Tuple (process, base URL).
+    """
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    env = dict(os.environ,
+               DATABASE_URI='sqlite:///' + os.path.abspath(args.database),
+               IMAGE_STORE_PATH=os.path.abspath(args.images))
+    if args.no_page_cache:
+        env['PAGE_CACHE_SIZE'] = '0'
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+        cwd=ROOT, env=env)
+    url = 'http://127.0.0.1:{0}'.format(port)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit('Application exited during startup.')
+        try:
+            response = requests.get(url + '/static/style.css', timeout=1)
+            if response.status_code == 200:
+                return process, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+
+    process.kill()
+    sys.exit('Application did not start within 30 seconds.')
+
+
+def load_ids(database):
+    """Returns IDs of categories, items and items with images to request."""
+
+    engine = create_engine('sqlite:///' + os.path.abspath(database))
+    ids = {
+        'categories': [row[0] for row in engine.execute(
+            'SELECT id FROM categories')],
+        'items': [row[0] for row in engine.execute('SELECT id FROM items')],
+        'images': [row[0] for row in engine.execute(
+            'SELECT id FROM items WHERE image_key IS NOT NULL')],
+    }
+    engine.dispose()
+
+    for name, values in ids.items():
+        if not values:
+            sys.exit('Database has no {0}; fill it with generate_data.py.'
+                     .format(name))
+
+    return ids
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which the given fraction of values fall."""
+
+    index = int(round(fraction * (len(sorted_values) - 1)))
+
+    return sorted_values[index]
+
+
+def run_route(url, paths, concurrency):
+    """Requests every path, concurrency requests at a time.
+
+    Returns:
+        Dictionary of latency percentiles in milliseconds, throughput in
+        requests per second, and number of failed requests.
+    """
+
+    local = threading.local()
+
+    def fetch(path):
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+
+        start = time.time()
+        response = local.http.get(url + path)
+        response.content
+        return time.time() - start, response.status_code < 400
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, paths))
+    elapsed = time.time() - start
+
+    timings = sorted(timing for timing, ok in results)
+
+    return {
+        'requests': len(results),
+        'errors': sum(1 for timing, ok in results if not ok),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'throughput_rps': len(results) / elapsed,
+    }
+
+
+def peak_child_rss_mb():
+    """Returns peak resident memory of exited child processes in MB."""
+
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    # Reported in bytes on macOS and kilobytes elsewhere.
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = '{0:<14} {1:>9} {2:>9} {3:>9} {4:>10} {5:>7}'.format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors')
+    print(header)
+    print('-' * len(header))
+
+    for name, route in results['routes'].items():
+        print('{0:<14} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>10.1f} {5:>7d}'
+              .format(name, route['p50_ms'], route['p95_ms'], route['p99_ms'],
+                      route['throughput_rps'], route['errors']))
+
+        old = baseline['routes'].get(name) if baseline else None
+        if old:
+            print('{0:<14} {1:>+8.0%} {2:>+8.0%} {3:>+8.0%} {4:>+9.0%}'.format(
+                '  vs baseline',
+                *[route[key] / old[key] - 1 if old[key] else 0 for key in
+                  ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')]))
+
+    print('\nPeak server RSS: {0:.1f} MB'.format(results['peak_rss_mb']))
+    if baseline:
+        print('Baseline:        {0:.1f} MB ({1})'.format(
+            baseline['peak_rss_mb'], baseline.get('commit')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='bench.db',
+                        help='Database filled by generate_data.py.')
+    parser.add_argument('--images', default='bench_images',
+                        help='Image store filled by generate_data.py.')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per page or image route.')
+    parser.add_argument('--export-requests', type=int, default=50,
+                        help='Requests per catalog export route.')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of clients making requests at once.')
+    parser.add_argument('--routes', nargs='+',
+                        choices=[route[0] for route in ROUTES],
+                        help='Routes to test; all by default.')
+    parser.add_argument('--no-page-cache', action='store_true',
+                        help='Disable the cache of rendered pages.')
+    parser.add_argument('--output',
+                        help='File to save results to; by default a new file '
+                             'in benchmarks/results/.')
+    parser.add_argument('--compare',
+                        help='Results file to compare this run against.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for choosing requested IDs.')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    random.seed(args.seed)
+    ids = load_ids(args.database)
+    process, url = start_server(args)
+
+    results = {
+        'started_at': datetime.utcnow().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {'requests': args.requests,
+                     'export_requests': args.export_requests,
+                     'concurrency': args.concurrency,
+                     'page_cache': not args.no_page_cache,
+                     'seed': args.seed,
+                     'categories': len(ids['categories']),
+                     'items': len(ids['items'])},
+        'routes': {},
+    }
+
+    try:
+        for name, export, path in ROUTES:
+            if args.routes and name not in args.routes:
+                continue
+
+            count = args.export_requests if export else args.requests
+            paths = [path(ids) for _ in range(count)]
+            # Warm up connections, caches and the database page cache.
+            run_route(url, paths[:args.concurrency], args.concurrency)
+            results['routes'][name] = run_route(url, paths, args.concurrency)
+    finally:
+        process.terminate()
+        process.wait()
+
+    results['peak_rss_mb'] = peak_child_rss_mb()
+
+    output = args.output
+    if output is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, '{0}-{1}.json'.format(
+            datetime.utcnow().strftime('%Y%m%d-%H%M%S'),
+            results['commit'] or 'unknown'))
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+    print('\nResults saved to {0}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measures how long signing in takes against a stub Google server with a
+given round-trip latency.
+
+Signing in makes one request to exchange the authorization code, then looks
+up the token and the user's profile at the same time, so it should take about
+two round trips.
+
+Usage:
+    python benchmarks/login.py [--latency SECONDS] [--logins N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google_stub import StubGoogleServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds by which every stub response is delayed.')
+    parser.add_argument('--logins', type=int, default=20,
+                        help='Number of sign-ins to take the median of.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    with StubGoogleServer(latency=args.latency) as server:
+        secrets_path = os.path.join(directory, 'client_secrets.json')
+        with open(secrets_path, 'w') as secrets_file:
+            json.dump(server.client_secrets(), secrets_file)
+
+        # Settings are read from the environment when the application loads.
+        os.environ.update(server.config())
+        os.environ['CLIENT_SECRETS_FILE'] = secrets_path
+        os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(directory,
+                                                                 'bench.db')
+        os.environ['IMAGE_STORE_PATH'] = os.path.join(directory, 'images')
+
+        from application import create_app
+        from database_setup import get_engine
+        from manage import upgrade_db
+
+        upgrade_db(get_engine())
+        app = create_app()
+        app.secret_key = 'benchmark'
+
+        timings = []
+        for _ in range(args.logins):
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['state'] = 'state'
+
+            start = time.time()
+            response = client.post('/gconnect?state=state', data='code')
+            timings.append(time.time() - start)
+
+            if response.status_code != 200:
+                sys.exit('Sign-in failed: {0} {1}'.format(
+                    response.status_code, response.get_data(as_text=True)))
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print('Latency per round trip: {0:>8.1f} ms'.format(args.latency * 1000))
+    print('Median sign-in time:    {0:>8.1f} ms ({1:.1f} round trips)'.format(
+        median * 1000, median / args.latency if args.latency else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Shows query plans and timings of the catalog's hot lookups on a synthetic
+database, before and after the lookup indexes are added.
+
+Usage:
+    python benchmarks/query_plans.py [--items N] [--database PATH]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from database_setup import Base
+from manage import add_lookup_indexes
+
+CATEGORIES = 50
+USERS = 1000
+
+# Hot queries issued by the application, with a function returning random
+# parameters for each run.
+QUERIES = [
+    ('get_user',
+     'SELECT id, name FROM users WHERE google_id = ?',
+     lambda items: ('google-{0}'.format(random.randint(1, USERS)),)),
+    ('category item count',
+     'SELECT count(id) FROM items WHERE category_id = ?',
+     lambda items: (random.randint(1, CATEGORIES),)),
+    ('category items',
+     'SELECT id, name FROM items WHERE category_id = ? ORDER BY id LIMIT 20',
+     lambda items: (random.randint(1, CATEGORIES),)),
+    ('latest items',
+     'SELECT id, name, category_id FROM items ORDER BY created_at DESC LIMIT 10',
+     lambda items: ()),
+    ('item by id',
+     'SELECT id, name, user_id FROM items WHERE id = ?',
+     lambda items: (random.randint(1, items),)),
+]
+
+LOOKUP_INDEXES = ['ix_users_google_id', 'ix_items_category_id',
+                  'ix_items_created_at']
+
+
+def populate(connection, items, batch_size=50000):
+    """Fills empty catalog database with synthetic categories, users and items.
+    """
+
+    cursor = connection.cursor()
+    cursor.executemany('INSERT INTO categories (id, name, item_count) '
+                       'VALUES (?, ?, 0)',
+                       [(i, 'Category {0}'.format(i))
+                        for i in range(1, CATEGORIES + 1)])
+    cursor.executemany('INSERT INTO users (id, google_id, name, email) '
+                       'VALUES (?, ?, ?, ?)',
+                       [(i, 'google-{0}'.format(i), 'User {0}'.format(i),
+                         'user{0}@example.com'.format(i))
+                        for i in range(1, USERS + 1)])
+
+    start = datetime(2015, 1, 1)
+    for first in range(1, items + 1, batch_size):
+        last = min(first + batch_size, items + 1)
+        cursor.executemany(
+            'INSERT INTO items (id, category_id, name, description, user_id, '
+            'created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(i, random.randint(1, CATEGORIES), 'Item {0}'.format(i),
+              'Description of item {0}'.format(i), random.randint(1, USERS),
+              start + timedelta(seconds=random.randint(0, 365 * 86400)))
+             for i in range(first, last)])
+
+    cursor.execute('UPDATE categories SET item_count = (SELECT count(*) FROM '
+                   'items WHERE items.category_id = categories.id)')
+    connection.commit()
+
+
+def report(connection, items, repeat):
+    """Prints query plan and median run time of each hot query."""
+
+    cursor = connection.cursor()
+    for name, sql, parameters in QUERIES:
+        plan = cursor.execute('EXPLAIN QUERY PLAN ' + sql,
+                              parameters(items)).fetchall()
+
+        def run():
+            cursor.execute(sql, parameters(items)).fetchall()
+
+        timings = sorted(timeit.repeat(run, number=1, repeat=repeat))
+        median = timings[len(timings) // 2] * 1000
+
+        print('{0:<22} {1:>10.3f} ms'.format(name, median))
+        for row in plan:
+            print('    {0}'.format(row[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000000,
+                        help='Number of items to generate.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Runs of each query to take the median of.')
+    parser.add_argument('--database',
+                        help='Database file to create; a temporary file by '
+                             'default.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for generated data.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    path = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine('sqlite:///' + path)
+    Base.metadata.create_all(engine)
+
+    # Start from the schema as it was before the lookup indexes existed.
+    for index in LOOKUP_INDEXES:
+        engine.execute('DROP INDEX IF EXISTS {0}'.format(index))
+
+    print('Generating {0} items in {1}...'.format(args.items, path))
+    connection = engine.raw_connection()
+    populate(connection, args.items)
+    connection.execute('ANALYZE')
+
+    print('\nWithout lookup indexes:')
+    report(connection, args.items, args.repeat)
+
+    connection.close()
+    with engine.begin() as sa_connection:
+        add_lookup_indexes(sa_connection)
+    connection = engine.raw_connection()
+    connection.execute('ANALYZE')
+
+    print('\nWith lookup indexes:')
+    report(connection, args.items, args.repeat)
+
+    connection.close()
+    if not args.database:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
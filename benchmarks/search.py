@@ -0,0 +1,122 @@
+"""Measures full-text search latency on a synthetic catalog.
+
+Usage:
+    python benchmarks/search.py [--items N] [--database PATH]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import catalog_helpers
+from database_setup import Base
+
+VOCABULARY = 20000
+WORDS_PER_NAME = 3
+WORDS_PER_DESCRIPTION = 25
+
+
+def word(rank):
+    """Returns synthetic word with the given frequency rank."""
+
+    return 'w{0}'.format(rank)
+
+
+def random_word():
+    """Picks a word with a Zipf-like distribution, so that a few words are
+    very common and most are rare, as in real text.
+    """
+
+    return word(min(int(random.paretovariate(1.0)), VOCABULARY) - 1)
+
+
+def populate(connection, items, batch_size=50000):
+    """Fills empty catalog database with synthetic items. The full-text index
+    is maintained by its triggers as the items are inserted.
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO categories (id, name, item_count) "
+                   "VALUES (1, 'Category', 0)")
+    cursor.execute("INSERT INTO users (id, google_id, name, email) "
+                   "VALUES (1, 'google-1', 'User', 'user@example.com')")
+
+    for first in range(1, items + 1, batch_size):
+        last = min(first + batch_size, items + 1)
+        cursor.executemany(
+            'INSERT INTO items (id, category_id, name, description, user_id) '
+            'VALUES (?, 1, ?, ?, 1)',
+            [(i,
+              ' '.join(random_word() for _ in range(WORDS_PER_NAME)),
+              ' '.join(random_word() for _ in range(WORDS_PER_DESCRIPTION)))
+             for i in range(first, last)])
+
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000000,
+                        help='Number of items to generate.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Runs of each search to take the median of.')
+    parser.add_argument('--database',
+                        help='Database file to create; a temporary file by '
+                             'default.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for generated data.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    path = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine('sqlite:///' + path)
+    Base.metadata.create_all(engine)
+
+    print('Generating {0} items in {1}...'.format(args.items, path))
+    start = time.time()
+    connection = engine.raw_connection()
+    populate(connection, args.items)
+    connection.close()
+    elapsed = time.time() - start
+    print('Inserted and indexed {0:.0f} items/s.\n'.format(
+        args.items / elapsed))
+
+    # Run searches through the application's own helper.
+    catalog_helpers.db_session = sessionmaker(bind=engine)()
+
+    searches = [
+        ('very common word', word(0)),
+        ('common word', word(10)),
+        ('rare word', word(5000)),
+        ('two common words', '{0} {1}'.format(word(1), word(2))),
+        ('common + rare word', '{0} {1}'.format(word(0), word(5000))),
+        ('prefix', 'w12'),
+        ('no match', 'nonexistent'),
+    ]
+
+    for name, terms in searches:
+        for page in (1, 10):
+            def run():
+                catalog_helpers.search_items(terms, page=page, limit=20)
+
+            timings = sorted(timeit.repeat(run, number=1, repeat=args.repeat))
+            median = timings[len(timings) // 2] * 1000
+            print('{0:<20} page {1:<3} {2:>10.3f} ms'.format(name, page, median))
+
+    catalog_helpers.db_session.close()
+    if not args.database:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
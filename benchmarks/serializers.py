@@ -0,0 +1,187 @@
+"""Compares ways of rendering the catalog export as JSON, reporting time and
+peak memory allocated per exported row, and the memory used by cached user
+profiles.
+
+The catalog is read from a database filled by generate_data.py. Renderers:
+
+    serialize   ORM objects turned into dictionaries and encoded by Flask's
+                json.dumps, as the export was first written.
+    columns     ORM column query, with json.dumps called per item.
+    templates   Core select, with rows formatted into precompiled templates,
+                as the application does now.
+
+Usage:
+    python benchmarks/serializers.py [--database PATH] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def render_serialize(db_session):
+    from flask import json as flask_json
+    from sqlalchemy.orm import selectinload
+
+    from database_setup import Category
+
+    categories = db_session.query(Category) \
+        .options(selectinload(Category.items)) \
+        .order_by(Category.id) \
+        .all()
+
+    return flask_json.dumps({'catalog': [{
+        'id': category.id,
+        'name': category.name,
+        'items': [{'id': item.id,
+                   'name': item.name,
+                   'description': item.description}
+                  for item in sorted(category.items, key=lambda i: i.id)]
+    } for category in categories]}) + '\n'
+
+
+def render_columns(db_session):
+    from database_setup import CatalogItem, Category
+
+    rows = db_session \
+        .query(Category.id, Category.name,
+               CatalogItem.id, CatalogItem.name, CatalogItem.description) \
+        .outerjoin(CatalogItem, CatalogItem.category_id == Category.id) \
+        .order_by(Category.id, CatalogItem.id) \
+        .yield_per(1000)
+
+    chunks = []
+    current_id = None
+    for category_id, category_name, item_id, item_name, description in rows:
+        if category_id != current_id:
+            chunks.append(']}, ' if current_id is not None else '')
+            chunks.append('{"id": %s, "name": %s, "items": [' %
+                          (json.dumps(category_id), json.dumps(category_name)))
+            first_item = True
+            current_id = category_id
+
+        if item_id is not None:
+            item = json.dumps({'id': item_id, 'name': item_name,
+                               'description': description}, sort_keys=True)
+            chunks.append(item if first_item else ', ' + item)
+            first_item = False
+
+    return '{"catalog": [' + ''.join(chunks) + \
+        (']}' if current_id is not None else '') + ']}\n'
+
+
+def render_templates(db_session):
+    from catalog_export import generate_json_catalog, iter_catalog_rows
+
+    return ''.join(generate_json_catalog(iter_catalog_rows(db_session)))
+
+
+RENDERERS = [
+    ('serialize', render_serialize),
+    ('columns', render_columns),
+    ('templates', render_templates),
+]
+
+
+def measure(renderer, db_session, repeat):
+    """Renders the catalog repeat times.
+
+    Returns:
+        Tuple (median seconds, peak bytes allocated, document).
+    """
+
+    timings = []
+    for _ in range(repeat):
+        # Each run starts from an empty session, so ORM objects loaded by
+        # the previous run aren't reused.
+        db_session.expunge_all()
+        start = time.time()
+        document = renderer(db_session)
+        timings.append(time.time() - start)
+
+    db_session.expunge_all()
+    tracemalloc.start()
+    renderer(db_session)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return sorted(timings)[len(timings) // 2], peak, document
+
+
+def profile_sizes(count):
+    """Returns bytes taken by count user profiles, with and without slots."""
+
+    from user_profile import UserProfile
+
+    class DictProfile(object):
+        def __init__(self, **attributes):
+            self.__dict__.update(attributes)
+
+    attributes = dict(id=1, google_id='user-1', username='User 1',
+                      email='user1@example.com',
+                      picture='https://example.com/user1.png', logged_in=True)
+
+    sizes = []
+    for profile_class in (DictProfile, UserProfile):
+        tracemalloc.start()
+        profiles = [profile_class(**attributes) for _ in range(count)]
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del profiles
+
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='bench.db',
+                        help='Database filled by generate_data.py.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of each renderer to take the median of.')
+    parser.add_argument('--profiles', type=int, default=10000,
+                        help='Number of user profiles to measure.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        sys.exit('{0} does not exist; fill it with generate_data.py.'
+                 .format(args.database))
+
+    # The database modules read DATABASE_URI when they're imported.
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.database)
+
+    from catalog_export import iter_catalog_rows
+    from database_setup import DBSession
+
+    db_session = DBSession()
+    rows = sum(1 for _ in iter_catalog_rows(db_session))
+
+    print('{0:<10} {1:>10} {2:>10} {3:>12}'.format(
+        'renderer', 'total ms', 'us/row', 'peak MB'))
+
+    expected = None
+    for name, renderer in RENDERERS:
+        elapsed, peak, document = measure(renderer, db_session, args.repeat)
+        print('{0:<10} {1:>10.1f} {2:>10.2f} {3:>12.1f}'.format(
+            name, elapsed * 1000, elapsed / rows * 1e6, peak / 1048576.0))
+
+        parsed = json.loads(document)
+        if expected is None:
+            expected = parsed
+        elif parsed != expected:
+            print('  output differs from {0}'.format(RENDERERS[0][0]))
+
+    db_session.close()
+
+    without_slots, with_slots = profile_sizes(args.profiles)
+    print('\n{0} user profiles: {1:.0f} KB with a __dict__, {2:.0f} KB with '
+          '__slots__'.format(args.profiles, without_slots / 1024.0,
+                             with_slots / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measures how long a fresh application process takes to start: importing
+the application, creating it with create_app, and handling its first
+request, which is when the database is first connected to.
+
+Each run starts a new Python process, so nothing is shared between runs
+except the operating system's file cache.
+
+Usage:
+    python benchmarks/startup.py [--database PATH] [--runs N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ['import', 'create_app', 'first_request', 'second_request']
+
+
+def run_once():
+    """Starts the application in this process and prints how long each
+    phase took, in seconds, as JSON.
+    """
+
+    sys.path.insert(0, ROOT)
+    timings = {}
+
+    start = time.time()
+    from application import create_app
+    timings['import'] = time.time() - start
+
+    start = time.time()
+    app = create_app()
+    timings['create_app'] = time.time() - start
+
+    client = app.test_client()
+    for phase in ('first_request', 'second_request'):
+        start = time.time()
+        response = client.get('/')
+        timings[phase] = time.time() - start
+        if response.status_code != 200:
+            sys.exit('GET / returned {0}.'.format(response.status_code))
+
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='bench.db',
+                        help='Database filled by generate_data.py.')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of processes to take the median of.')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_once()
+        return
+
+    if not os.path.exists(args.database):
+        sys.exit('{0} does not exist; fill it with generate_data.py.'
+                 .format(args.database))
+
+    env = dict(os.environ,
+               DATABASE_URI='sqlite:///' + os.path.abspath(args.database),
+               PAGE_CACHE_SIZE='0')
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child'],
+            cwd=ROOT, env=env)
+        runs.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    for phase in PHASES:
+        timings = sorted(run[phase] for run in runs)
+        print('{0:<16} {1:>10.1f} ms'.format(
+            phase, timings[len(timings) // 2] * 1000))
+
+    total = sorted(sum(run[phase] for phase in PHASES[:3]) for run in runs)
+    print('{0:<16} {1:>10.1f} ms'.format(
+        'until first page', total[len(total) // 2] * 1000))
+
+
+if __name__ == '__main__':
+    main()
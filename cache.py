@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LRUCache(object):
+    """Thread-safe in-process cache. Entries expire ttl
+    seconds after they were stored, and once max_entries are stored the least
+    recently used entry is evicted to make room for a new one. If max_size is
+    set, least recently used entries are also evicted to keep the total size
+    of values, as measured by sizeof, within max_size; larger values aren't
+    cached at all.
+
+    Attributes:
+        max_entries: Maximum number of entries kept.
+        ttl: Seconds for which an entry stays valid.
+        max_size: Maximum total size of values, or None for no limit.
+        size: Total size of values currently kept.
+        hits: Number of lookups that found a valid entry.
+        misses: Number of lookups that didn't.
+    """
+
+    def __init__(self, max_entries=1000, ttl=60, clock=time.time,
+                 max_size=None, sizeof=len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retrieves cached value.
+
+        Args:
+            key: Key of entry.
+
+        Returns:
+            Cached value, or None if there is no valid entry for key.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            # Mark entry as most recently used.
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key, value):
+        """Stores value, evicting least recently used entries if the cache
+        is full. Storing a value again updates its size.
+
+        Args:
+            key: Key of entry.
+            value: Value to cache.
+        """
+
+        if self.max_entries < 1:
+            return
+
+        size = self._sizeof(value) if self.max_size is not None else 0
+
+        with self._lock:
+            self._remove(key)
+            if self.max_size is not None and size > self.max_size:
+                return
+
+            while self._entries and (
+                    len(self._entries) >= self.max_entries or
+                    (self.max_size is not None and
+                     self.size + size > self.max_size)):
+                self._remove(next(iter(self._entries)))
+
+            self._entries[key] = (self._clock() + self.ttl, value, size)
+            self.size += size
+
+    def delete(self, key):
+        """Removes entry, if there is one.
+
+        Args:
+            key: Key of entry.
+        """
+
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Removes all entries."""
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class KeyedLocks(object):
+    """Locks created on demand, one per key, so that work on different keys
+    doesn't wait on one lock. A key's lock is dropped once nobody holds or
+    waits for it.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        """Context manager holding the lock of key for its block."""
+
+        with self._lock:
+            lock, users = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, users + 1)
+
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
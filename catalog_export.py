@@ -0,0 +1,346 @@
+import threading
+import zlib
+from json.encoder import encode_basestring_ascii as encode_json_string
+from xml.sax.saxutils import escape
+
+from sqlalchemy import and_, or_, select
+
+from database_setup import CatalogItem, Category
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Number of rows fetched from the database per round trip while exporting.
+EXPORT_BATCH_SIZE = 1000
+
+# Exported documents are sent in chunks of at least this many characters.
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Templates of the JSON written per category and item. Item and change keys
+# are in the order Flask's JSON encoder sorts them in; category keys keep the
+# order the export has always used, with "items" last so that items can be
+# streamed. Strings are encoded by the same (C-accelerated, ASCII-only)
+# function as json.dumps uses, without the cost of a json.dumps call per row.
+JSON_CATEGORY = '{"id": %d, "name": %s, "items": ['
+JSON_ITEM = '{"description": %s, "id": %d, "name": %s}'
+
+JSON_CHANGE = '{"changed_at": %s, "data": %s, "id": %d, "operation": %s, ' \
+    '"seq": %d, "type": %s}'
+
+XML_CATEGORY = '  <category>\n    <id>%d</id>\n'
+XML_ITEM = ('    <items>\n'
+            '      <description>%s</description>\n'
+            '      <id>%d</id>\n'
+            '      <name>%s</name>\n'
+            '    </items>\n')
+
+# Content codings exports are cached in, in order of preference.
+EXPORT_ENCODINGS = (['br'] if brotli is not None else []) + \
+    ['gzip', 'identity']
+
+
+class CachedExport(object):
+    """Rendered export of the catalog, or a page of it, kept in memory. The
+    document is compressed in a content coding of EXPORT_ENCODINGS the first
+    time a client asks for that coding, and kept that way too.
+
+    Attributes:
+        version: Catalog version the export was rendered at.
+        last_id: ID of the last category on the page, as from get_page_bounds.
+        has_more: True if categories follow the page.
+        bodies: Dictionary of encoded documents by content coding, holding
+                only the codings asked for so far. Empty if the document was
+                too large to keep, which is remembered so that it isn't
+                rendered again until the catalog changes.
+    """
+
+    def __init__(self, version, last_id, has_more, document):
+        self.version = version
+        self.last_id = last_id
+        self.has_more = has_more
+        self.bodies = {'identity': document} if document is not None else {}
+        self._lock = threading.Lock()
+
+    @property
+    def too_large(self):
+        """True if the document wasn't kept."""
+
+        return not self.bodies
+
+    @property
+    def size(self):
+        """Number of bytes taken by the encoded documents."""
+
+        return sum(len(body) for body in list(self.bodies.values()))
+
+    def body(self, encoding):
+        """Returns the document in the given content coding, compressing it
+        first if no client has asked for that coding yet.
+        """
+
+        with self._lock:
+            body = self.bodies.get(encoding)
+            if body is None:
+                body = compress_document(self.bodies['identity'], encoding)
+                self.bodies[encoding] = body
+
+        return body
+
+
+def compress_document(document, encoding):
+    """Encodes document in a content coding of EXPORT_ENCODINGS.
+
+    Args:
+        document: Document as a byte string.
+        encoding: "gzip", "br" or "identity".
+
+    Returns:
+        Encoded document.
+    """
+
+    if encoding == 'gzip':
+        # A window size of 16 + MAX_WBITS makes zlib write a gzip container.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(document) + compressor.flush()
+    if encoding == 'br':
+        return brotli.compress(document, quality=9)
+
+    return document
+
+
+def join_document(chunks, max_size):
+    """Joins chunks of a rendered document into one UTF-8 byte string, unless
+    it grows beyond max_size bytes (None for no limit).
+
+    Returns:
+        Document, or None if it's larger than max_size.
+    """
+
+    parts = []
+    size = 0
+    for chunk in chunks:
+        part = chunk.encode('utf-8')
+        size += len(part)
+        if max_size is not None and size > max_size:
+            return None
+        parts.append(part)
+
+    return b''.join(parts)
+
+
+def get_page_bounds(db_session, after=None, limit=None):
+    """Determines which categories fall on a page of the exported catalog.
+
+    Args:
+        db_session: Active database session.
+        after: Only categories with an ID greater than this are included.
+        limit: Maximum number of categories on the page, or None for all.
+
+    Returns:
+        Tuple (last_id, has_more). last_id is the ID of the last category
+        on the page (None if the page runs to the end of the catalog), and
+        has_more is True if there are categories beyond the page.
+    """
+
+    if limit is None:
+        return None, False
+
+    query = db_session.query(Category.id).order_by(Category.id)
+    if after is not None:
+        query = query.filter(Category.id > after)
+
+    last = query.offset(limit - 1).limit(1).first()
+    if last is None:
+        return None, False
+
+    has_more = db_session.query(Category.id) \
+        .filter(Category.id > last.id) \
+        .first() is not None
+
+    return last.id, has_more
+
+
+def iter_catalog_rows(db_session, after=None, last_id=None,
+                      batch_size=EXPORT_BATCH_SIZE):
+    """Yields one row per catalog item, ordered by category ID and then item ID.
+    Rows are read in keyset-ordered batches so only batch_size rows are held in
+    memory at a time, no matter how large the catalog is.
+
+    Args:
+        db_session: Active database session.
+        after: Only categories with an ID greater than this are included.
+        last_id: Only categories with an ID up to this are included.
+        batch_size: Number of rows to fetch per query.
+
+    Yields:
+        Tuples (category_id, category_name, item_id, item_name, description).
+        Categories without any items yield a single row whose item fields are
+        None.
+    """
+
+    # Rows are read with a Core select rather than an ORM query, which
+    # builds a named tuple per row that the renderers have no use for.
+    query = select([Category.id, Category.name,
+                    CatalogItem.id, CatalogItem.name, CatalogItem.description]) \
+        .select_from(Category.__table__.outerjoin(
+            CatalogItem.__table__, CatalogItem.category_id == Category.id)) \
+        .order_by(Category.id, CatalogItem.id)
+
+    if after is not None:
+        query = query.where(Category.id > after)
+    if last_id is not None:
+        query = query.where(Category.id <= last_id)
+
+    batch = db_session.execute(query.limit(batch_size)).fetchall()
+    while batch:
+        for row in batch:
+            yield tuple(row)
+
+        if len(batch) < batch_size:
+            return
+
+        # Resume right after the last row seen rather than using OFFSET,
+        # which would make every batch rescan the rows before it.
+        category_id, item_id = batch[-1][0], batch[-1][2]
+        if item_id is None:
+            keyset = Category.id > category_id
+        else:
+            # The lower bound on Category.id lets the database seek to the
+            # current category instead of scanning from the first one.
+            keyset = and_(Category.id >= category_id,
+                          or_(Category.id > category_id,
+                              CatalogItem.id > item_id))
+
+        batch = db_session.execute(
+            query.where(keyset).limit(batch_size)).fetchall()
+
+
+def generate_json_catalog(rows):
+    """Renders catalog rows as a JSON document, one chunk at a time. Each
+    category is an object with "id", "name" and a list of "items", each item
+    an object with "id", "name" and "description".
+
+    Args:
+        rows: Iterable of rows as produced by iter_catalog_rows.
+
+    Yields:
+        Chunks of the JSON document.
+    """
+
+    yield '{"catalog": ['
+
+    current_id = None
+    for category_id, category_name, item_id, item_name, description in rows:
+        if category_id != current_id:
+            if current_id is not None:
+                yield ']}, '
+            yield JSON_CATEGORY % (category_id,
+                                   encode_json_string(category_name))
+            first_item = True
+            current_id = category_id
+
+        if item_id is not None:
+            item = JSON_ITEM % (encode_json_string(description), item_id,
+                                encode_json_string(item_name))
+            yield item if first_item else ', ' + item
+            first_item = False
+
+    if current_id is not None:
+        yield ']}'
+
+    yield ']}\n'
+
+
+def generate_xml_catalog(rows):
+    """Renders catalog rows as an XML document, one chunk at a time. Output
+    has the same structure as the JSON document, with a <category> element
+    per category and an <items> element per item, as dict2xml would render
+    it.
+
+    Args:
+        rows: Iterable of rows as produced by iter_catalog_rows.
+
+    Yields:
+        Chunks of the XML document.
+    """
+
+    yield '<catalog>\n'
+
+    current_id = current_name = None
+    has_items = False
+    for category_id, category_name, item_id, item_name, description in rows:
+        if category_id != current_id:
+            if current_id is not None:
+                yield _close_xml_category(current_name, has_items)
+            yield XML_CATEGORY % category_id
+            current_id, current_name = category_id, category_name
+            has_items = False
+
+        if item_id is not None:
+            yield XML_ITEM % (escape(description), item_id, escape(item_name))
+            has_items = True
+
+    if current_id is not None:
+        yield _close_xml_category(current_name, has_items)
+
+    yield '</catalog>'
+
+
+def _close_xml_category(name, has_items):
+    """Returns the XML closing a <category> element."""
+
+    empty_items = '' if has_items else '    <items></items>\n'
+
+    return '%s    <name>%s</name>\n  </category>\n' % (empty_items, escape(name))
+
+
+def buffer_chunks(chunks, size=EXPORT_CHUNK_SIZE):
+    """Joins small chunks of a rendered document into chunks of at least size
+    characters, so that the per-chunk overhead of sending a response is paid
+    once per chunk rather than once per row."""
+
+    buffered = []
+    length = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered = []
+            length = 0
+
+    if buffered:
+        yield ''.join(buffered)
+
+
+def generate_json_changes(changes, next_seq, has_more, latest):
+    """Renders a page of the change log as JSON. Entities' data is stored as
+    JSON already, so it is copied into the document as is.
+
+    Args:
+        changes: Rows with sequence number, entity, entity ID, operation,
+                 data and time of change.
+        next_seq: Sequence number to request the following page after.
+        has_more: True if more changes follow.
+        latest: Sequence number of the latest change.
+
+    Returns:
+        JSON document.
+    """
+
+    return '{"changes": [%s], "has_more": %s, "latest": %d, "next": %d}\n' % (
+        ', '.join(format_json_change(change) for change in changes),
+        'true' if has_more else 'false', latest, next_seq)
+
+
+def format_json_change(change):
+    """Renders one row of the change log as a JSON object."""
+
+    seq, entity, entity_id, operation, data, changed_at = change
+
+    return JSON_CHANGE % (encode_json_string(changed_at.isoformat() + 'Z'),
+                          data if data is not None else 'null', entity_id,
+                          encode_json_string(operation), seq,
+                          encode_json_string(entity))
@@ -1,25 +1,36 @@
-import random
-import string
-from flask import session, make_response
-from sqlalchemy import func
-from sqlalchemy.orm.exc import NoResultFound
-from application import db_session
-from database_setup import CatalogItem, Category, User
+import binascii
+import os
+import re
+import time
+from flask import session, make_response, g, has_app_context, current_app, \
+    json
+from sqlalchemy import func, event, text
+from sqlalchemy.engine import Engine
+from database_setup import CatalogChange, CatalogItem, CatalogVersion, \
+    Category, User, db_session
+from image_processing import VARIANT_WIDTHS, variant_key
+from image_store import guess_image_type
+from services import image_store, image_processor, user_cache
 from user_profile import UserProfile
 
+try:
+    # JSON strings are decoded to unicode on Python 2.
+    string_types = basestring
+except NameError:
+    string_types = str
+
 
 # Token-related helpers
 
 def generate_token():
-    """Generates and returns a 32-character token string.
+    """Generates and returns a 32-character random hexadecimal token string.
     """
 
-    return ''.join(
-        random.choice(string.ascii_uppercase + string.digits) for _ in xrange(32))
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
 
 
 def insert_signin_state():
-    """Inserts Google sign-in token into active session.
+    """Inserts new Google sign-in token into active session.
     """
 
     session['state'] = generate_token()
@@ -33,10 +44,16 @@ def insert_csrf_token():
 
 
 def get_signin_token():
-    """Retrieves Google sign-in token from active session.
+    """Retrieves Google sign-in token from active session, inserting one first
+    if the session doesn't have one yet. The token is kept for the rest of
+    the session, so showing a page doesn't modify the session (and resend
+    the session cookie) unless it is the visitor's first.
     """
 
-    return session.get('state')
+    if 'state' not in session:
+        insert_signin_state()
+
+    return session['state']
 
 
 def get_csrf_token():
@@ -46,6 +63,100 @@ def get_csrf_token():
     return session.get('csrf_token')
 
 
+# Request-local caching helpers
+
+def request_cache(name):
+    """Returns dictionary named name that lives only as long as the current
+    request. Used to make sure each entity is fetched at most once per
+    request, however many helpers ask for it.
+
+    Args:
+        name: Name of cache.
+    """
+
+    if not hasattr(g, 'request_caches'):
+        g.request_caches = {}
+
+    return g.request_caches.setdefault(name, {})
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """Counts SQL statements executed during the current request.
+    """
+
+    context.query_started_at = time.time()
+
+    if has_app_context():
+        g.query_count = getattr(g, 'query_count', 0) + 1
+
+
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    """Adds up time spent running SQL statements during the current request.
+    If slow requests are logged, statements are kept along with their run
+    times so that the log can show them.
+    """
+
+    if not has_app_context():
+        return
+
+    elapsed = time.time() - context.query_started_at
+    g.query_time = getattr(g, 'query_time', 0.0) + elapsed
+
+    if current_app.config['SLOW_REQUEST_THRESHOLD']:
+        g.setdefault('queries', []).append((elapsed, statement))
+
+
+# Listening on the Engine class counts statements of every engine, including
+# those created after this module is imported.
+event.listen(Engine, 'before_cursor_execute', count_query)
+event.listen(Engine, 'after_cursor_execute', time_query)
+
+
+@event.listens_for(db_session, 'after_commit')
+def record_commit(session):
+    """Notes that the current request wrote to the primary database, so that
+    the visitor's next requests can be kept off a lagging replica.
+    """
+
+    if has_app_context():
+        g.committed = True
+
+
+def get_query_count():
+    """Returns number of SQL statements executed so far during the current
+    request.
+    """
+
+    return getattr(g, 'query_count', 0)
+
+
+def get_query_time():
+    """Returns seconds spent running SQL statements so far during the current
+    request.
+    """
+
+    return getattr(g, 'query_time', 0.0)
+
+
+# Item-related helpers
+
+def get_item(item_id):
+    """Retrieves CatalogItem instance from database, at most once per request.
+
+    Args:
+        item_id: ID of item.
+
+    Returns:
+        CatalogItem instance with ID item_id, or None if there is none.
+    """
+
+    items = request_cache('items')
+    if item_id not in items:
+        items[item_id] = db_session.query(CatalogItem).get(item_id)
+
+    return items[item_id]
+
+
 # User-related helpers
 
 def user_owns_item(item_id):
@@ -61,61 +172,87 @@ def user_owns_item(item_id):
 
     if session.get('logged_in'):
         user = get_user(session.get('google_id'))
-        item = db_session.query(CatalogItem).filter_by(id=item_id).one()
+        item = get_item(item_id)
 
-        return user.id == item.user_id
+        return user is not None and item is not None and \
+            user.id == item.user_id
 
     return False
 
 
-def create_user(login_session):
-    """Creates new User instance and inserts it into the database.
+def save_user(google_id, name, email, picture):
+    """Creates user with the given Google profile, or updates the stored
+    profile of an existing user if it has changed since they last signed in.
 
     Args:
-        login_session: Active session.
+        google_id: Google ID of user.
+        name: User's username on Google profile.
+        email: User's e-mail address on Google profile.
+        picture: URL of user's picture on Google profile.
 
     Returns:
-        Newly-created User instance.
+        UserProfile of user.
     """
 
-    new_user = User(name=login_session['username'],
-                    picture=login_session['picture'],
-                    email=login_session['email'],
-                    google_id=login_session['google_id'])
+    user = db_session.query(User).filter_by(google_id=google_id).first()
+    if user is None:
+        user = User(google_id=google_id)
+        db_session.add(user)
 
-    db_session.add(new_user)
-    db_session.commit()
+    if (user.name, user.email, user.picture) != (name, email, picture):
+        user.name = name
+        user.email = email
+        user.picture = picture
+        db_session.commit()
 
-    return db_session.query(User).filter_by(google_id=login_session['google_id']).one()
+        user_cache.delete(google_id)
+        request_cache('users').pop(google_id, None)
+
+    return get_user(google_id)
 
 
 def get_user(google_id):
-    """Retrieves User instance from database based on Google ID.
+    """Retrieves profile of user based on Google ID. Profiles are cached in
+    user_cache, so the database is only queried on a cache miss.
 
     Args:
         google_id: Google ID of user.
 
     Returns:
-        User instance associated with google_id.
+        UserProfile of user associated with google_id, or None if there is no
+        such user.
     """
-    try:
-        user = db_session.query(User).filter_by(google_id=google_id).one()
-        return user
 
-    except NoResultFound:
-        return None
+    users = request_cache('users')
+    if google_id not in users:
+        profile = user_cache.get(google_id)
+        if profile is None:
+            user = db_session.query(User.id, User.name, User.email,
+                                    User.picture) \
+                .filter_by(google_id=google_id) \
+                .first()
+            if user is not None:
+                profile = UserProfile(id=user.id,
+                                      google_id=google_id,
+                                      username=user.name,
+                                      email=user.email,
+                                      picture=user.picture,
+                                      logged_in=True)
+                user_cache.set(google_id, profile)
+
+        users[google_id] = profile
+
+    return users[google_id]
 
 
 def get_current_user_profile():
-    """Builds and returns UserProfile instance based on information in
-    current active session.
+    """Returns UserProfile of user signed in to the current active session.
     """
 
     if session.get('logged_in'):
-        return UserProfile(username=session.get('username'),
-                           email=session.get('email'),
-                           picture=session.get('picture'),
-                           logged_in=True)
+        profile = get_user(session.get('google_id'))
+        if profile is not None:
+            return profile
 
     return UserProfile(logged_in=False)
 
@@ -124,19 +261,550 @@ def get_current_user_profile():
 
 def get_category_summary():
     """Retrieves list of summary information for categories in database.
-    Fields include ID, name, and item count.
+    Fields include ID, name, and item count. Item counts are read from the
+    categories table, which is maintained by adjust_item_count, so the items
+    table is never scanned.
 
     Returns:
         List of summary category data.
     """
 
-    categories = db_session \
-        .query(Category.id, Category.name,
-               func.count(CatalogItem.category_id).label('item_count')) \
-        .outerjoin(CatalogItem) \
-        .group_by(Category.id) \
+    cache = request_cache('category_summary')
+    if 'categories' not in cache:
+        cache['categories'] = db_session \
+            .query(Category.id, Category.name, Category.item_count) \
+            .order_by(Category.id) \
+            .all()
+
+    return cache['categories']
+
+
+def get_category(category_id):
+    """Retrieves summary information for a single category from the category
+    summary, so it costs no query beyond the one the sidebar needs anyway.
+
+    Args:
+        category_id: ID of category.
+
+    Returns:
+        Summary category data with ID, name, and item count, or None if there
+        is no such category.
+    """
+
+    for category in get_category_summary():
+        if category.id == category_id:
+            return category
+
+    return None
+
+
+def get_latest_items(limit=10):
+    """Retrieves most recently created items for the home page. Only the
+    columns the page shows are loaded, and category names are joined in, so
+    listing the items takes a single query.
+
+    Args:
+        limit: Number of items to retrieve.
+
+    Returns:
+        List of rows with ID, name, category ID and category name, newest
+        first.
+    """
+
+    return db_session \
+        .query(CatalogItem.id, CatalogItem.name, CatalogItem.category_id,
+               Category.name.label('category_name')) \
+        .join(Category, Category.id == CatalogItem.category_id) \
+        .order_by(CatalogItem.created_at.desc()) \
+        .limit(limit) \
+        .all()
+
+
+def get_category_items(category_id, after=None, limit=50):
+    """Retrieves one page of a category's items, ordered by ID. Pages are
+    selected by the ID of the last item on the previous page rather than by
+    offset, so every page is a single index range scan however deep into
+    the category it is. Only the columns needed for listing are loaded.
+
+    Args:
+        category_id: ID of category.
+        after: ID of the last item on the previous page, or None for the
+               first page.
+        limit: Maximum number of items on the page.
+
+    Returns:
+        Tuple (items, next_after). items is a list of rows with ID and name;
+        next_after is the value of "after" for the following page, or None if
+        this is the last page.
+    """
+
+    query = db_session.query(CatalogItem.id, CatalogItem.name) \
+        .filter_by(category_id=category_id) \
+        .order_by(CatalogItem.id)
+
+    if after is not None:
+        query = query.filter(CatalogItem.id > after)
+
+    # Fetch one extra row to find out whether another page follows.
+    items = query.limit(limit + 1).all()
+    if len(items) > limit:
+        return items[:limit], items[limit - 1].id
+
+    return items, None
+
+
+def adjust_item_count(category_id, delta):
+    """Adds delta to cached item count of category. Must be called in the same
+    transaction that adds items to or removes them from the category, so that
+    the count is committed (or rolled back) together with the change.
+
+    Args:
+        category_id: ID of category; may be None.
+        delta: Number of items added to category; negative for removals.
+    """
+
+    if category_id is None:
+        return
+
+    db_session.query(Category) \
+        .filter_by(id=category_id) \
+        .update({Category.item_count: Category.item_count + delta},
+                synchronize_session=False)
+
+
+def bump_catalog_version():
+    """Marks the catalog as changed, so that exports are rendered anew and
+    clients holding an older copy are sent the new one. Must be called in the
+    same transaction that changes categories or items, before it writes
+    anything else, so that the version row is always locked first.
+    """
+
+    db_session.execute(CatalogVersion.bump())
+
+
+def get_catalog_version():
+    """Retrieves the catalog's current version.
+
+    Returns:
+        Row with version number and time of the latest change.
+    """
+
+    return db_session.query(CatalogVersion.version, CatalogVersion.updated_at,
+                            CatalogVersion.pruned_seq) \
+        .filter_by(id=1) \
+        .one()
+
+
+# Change log helpers
+
+def record_item_change(item, deleted=False):
+    """Appends change of item to the change log. Must be called in the same
+    transaction that changes the item, after bump_catalog_version().
+
+    Args:
+        item: CatalogItem created, updated or deleted.
+        deleted: True if item was deleted.
+    """
+
+    # Flushing assigns new items their IDs.
+    db_session.flush()
+    db_session.execute(CatalogChange.__table__.insert(),
+                       item_change_row(item, deleted))
+
+
+def record_category_change(category):
+    """Appends change of category to the change log. Must be called in the
+    same transaction that changes the category, after bump_catalog_version().
+
+    Args:
+        category: Category created or updated.
+    """
+
+    # Flushing assigns new categories their IDs.
+    db_session.flush()
+    db_session.execute(CatalogChange.__table__.insert(), {
+        'entity': 'category',
+        'entity_id': category.id,
+        'operation': 'upsert',
+        'data': json.dumps({'id': category.id, 'name': category.name}),
+    })
+
+
+def item_change_row(item, deleted=False):
+    """Returns change log row recording change of item, which must have been
+    flushed to the database already."""
+
+    if deleted:
+        data = None
+    else:
+        data = json.dumps({'id': item.id,
+                           'name': item.name,
+                           'description': item.description,
+                           'category_id': item.category_id})
+
+    return {
+        'entity': 'item',
+        'entity_id': item.id,
+        'operation': 'delete' if deleted else 'upsert',
+        'data': data,
+    }
+
+
+def get_changes(since, limit):
+    """Retrieves changes made after the change with sequence number since, in
+    the order they were made.
+
+    Args:
+        since: Sequence number of the last change the client has seen; 0 for
+               none.
+        limit: Maximum number of changes to retrieve.
+
+    Returns:
+        List of rows with sequence number, entity, entity ID, operation, data
+        and time of change, as rendered by catalog_export.format_json_change.
+    """
+
+    return db_session.query(CatalogChange.seq, CatalogChange.entity,
+                            CatalogChange.entity_id, CatalogChange.operation,
+                            CatalogChange.data, CatalogChange.changed_at) \
+        .filter(CatalogChange.seq > since) \
+        .order_by(CatalogChange.seq) \
+        .limit(limit) \
         .all()
-    return categories
+
+
+def get_latest_change_seq():
+    """Returns sequence number of the latest change, or of the latest pruned
+    one if the log has been pruned empty, so that clients can always resume
+    from it. 0 if there has been no change at all.
+    """
+
+    latest = db_session.query(func.max(CatalogChange.seq)).scalar() or 0
+
+    return max(latest, get_catalog_version().pruned_seq)
+
+
+# Batch write helpers
+
+# Operations accepted by apply_item_batch.
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+
+
+def validate_item_fields(operation, required):
+    """Checks item fields of a batch operation.
+
+    Args:
+        operation: Dictionary describing operation.
+        required: If True, every field must be present, as when creating an
+                  item; otherwise at least one.
+
+    Returns:
+        Tuple (fields, error). fields is a dictionary of the valid fields
+        present; error is a message describing the first invalid field, or
+        None.
+    """
+
+    fields = {}
+
+    for name in ('name', 'description'):
+        if name not in operation:
+            continue
+
+        value = operation[name]
+        max_length = getattr(CatalogItem, name).type.length
+        if not isinstance(value, string_types) or not value.strip():
+            return None, '"{0}" must be a non-empty string.'.format(name)
+        if len(value) > max_length:
+            return None, '"{0}" must be at most {1} characters long.' \
+                .format(name, max_length)
+        fields[name] = value
+
+    if 'category_id' in operation:
+        category_id = operation['category_id']
+        if not isinstance(category_id, int) or isinstance(category_id, bool):
+            return None, '"category_id" must be an integer.'
+        if get_category(category_id) is None:
+            return None, 'Category {0} does not exist.'.format(category_id)
+        fields['category_id'] = category_id
+
+    if required:
+        for name in ('name', 'description', 'category_id'):
+            if name not in fields:
+                return None, '"{0}" is required.'.format(name)
+    elif not fields:
+        return None, 'Nothing to update.'
+
+    return fields, None
+
+
+def apply_item_batch(operations, user_id):
+    """Creates, updates and deletes items as listed in operations, all in one
+    transaction. Items to update or delete are loaded, and their ownership
+    checked, in a single query. If any operation is invalid, none is
+    applied.
+
+    Each operation is a dictionary with an "op" of "create", "update" or
+    "delete". Creates give "name", "description" and "category_id"; updates
+    give the "id" of the item and any of those fields; deletes give only the
+    "id". Item images are left as they are, except that images no longer used
+    by any item after a delete are released.
+
+    Category item counts, the catalog version and the change log are updated
+    in the same transaction, and the search index by the database itself.
+
+    Args:
+        operations: List of operations.
+        user_id: ID of user making the changes, who must own the items
+                 updated or deleted.
+
+    Returns:
+        Tuple (results, applied). results lists, for each operation, a
+        dictionary with its "index", "op", item "id" and "status", which is
+        "created", "updated", "deleted" or "error" (with an "error"
+        message). applied is True if the batch was committed.
+    """
+
+    item_ids = set(operation.get('id') for operation in operations
+                   if isinstance(operation, dict) and
+                   isinstance(operation.get('id'), int))
+    items = {}
+    if item_ids:
+        items = dict((item.id, item) for item in db_session.query(CatalogItem)
+                     .filter(CatalogItem.id.in_(item_ids)))
+
+    results = []
+    changes = []
+    count_deltas = {}
+    released_images = []
+
+    for index, operation in enumerate(operations):
+        kind = operation.get('op') if isinstance(operation, dict) else None
+        result = {'index': index, 'op': kind, 'id': None}
+        results.append(result)
+
+        error = None
+        if kind not in BATCH_OPERATIONS:
+            error = '"op" must be one of {0}.'.format(
+                ', '.join(BATCH_OPERATIONS))
+        elif kind == 'create':
+            fields, error = validate_item_fields(operation, required=True)
+            if error is None:
+                item = CatalogItem(user_id=user_id, **fields)
+                db_session.add(item)
+                changes.append((result, item, 'created'))
+                count_deltas[item.category_id] = \
+                    count_deltas.get(item.category_id, 0) + 1
+        else:
+            result['id'] = operation.get('id')
+            item = items.get(result['id'])
+            if item is None:
+                error = 'Item not found.'
+            elif item.user_id != user_id:
+                error = 'User is not authorized to change this item.'
+            elif kind == 'update':
+                fields, error = validate_item_fields(operation, required=False)
+                if error is None:
+                    count_deltas[item.category_id] = \
+                        count_deltas.get(item.category_id, 0) - 1
+                    for name, value in fields.items():
+                        setattr(item, name, value)
+                    count_deltas[item.category_id] = \
+                        count_deltas.get(item.category_id, 0) + 1
+                    changes.append((result, item, 'updated'))
+            else:
+                db_session.delete(item)
+                del items[item.id]
+                changes.append((result, item, 'deleted'))
+                count_deltas[item.category_id] = \
+                    count_deltas.get(item.category_id, 0) - 1
+                released_images.append(item.image_key)
+
+        if error is not None:
+            result['status'] = 'error'
+            result['error'] = error
+
+    if any(result.get('error') for result in results):
+        db_session.rollback()
+        for result in results:
+            result.setdefault('status', 'not applied')
+        return results, False
+
+    bump_catalog_version()
+    for category_id, delta in count_deltas.items():
+        if delta:
+            adjust_item_count(category_id, delta)
+
+    # Log every change with one statement, once flushing has assigned new
+    # items their IDs.
+    db_session.flush()
+    for result, item, status in changes:
+        result['id'] = item.id
+        result['status'] = status
+    db_session.execute(CatalogChange.__table__.insert(), [
+        item_change_row(item, deleted=(status == 'deleted'))
+        for result, item, status in changes])
+
+    db_session.commit()
+    request_cache('items').clear()
+
+    for image_key in released_images:
+        release_image(image_key)
+
+    return results, True
+
+
+# Search helpers
+
+SQLITE_SEARCH_SQL = text("""
+    SELECT items.id, items.name, items.description, items.category_id
+    FROM items_fts JOIN items ON items.id = items_fts.rowid
+    WHERE items_fts MATCH :match
+    ORDER BY bm25(items_fts, 10.0, 1.0)
+    LIMIT :limit OFFSET :offset""")
+
+# PostgreSQL matches on the expression of the ix_items_search index, and ranks
+# names ten times higher than descriptions through the weights given to
+# ts_rank (for D, C, B and A labelled lexemes).
+POSTGRESQL_SEARCH_SQL = text("""
+    SELECT items.id, items.name, items.description, items.category_id
+    FROM items, to_tsquery('english', :match) AS query
+    WHERE to_tsvector('english', items.name || ' ' || items.description)
+        @@ query
+    ORDER BY ts_rank(CAST('{0.1, 0.1, 0.1, 1.0}' AS float4[]),
+                     setweight(to_tsvector('english', items.name), 'A') ||
+                     setweight(to_tsvector('english', items.description),
+                               'B'),
+                     query) DESC, items.id
+    LIMIT :limit OFFSET :offset""")
+
+
+def build_match_expression(terms):
+    """Turns free-form user input into an FTS5 query matching items that
+    contain every word in it. Words are quoted, so characters with a meaning
+    in FTS5 query syntax are searched for literally instead of causing
+    syntax errors. The last word also matches as a prefix.
+
+    Args:
+        terms: Search string entered by user.
+
+    Returns:
+        FTS5 query string, or None if terms contains no words.
+    """
+
+    words = terms.split()
+    if not words:
+        return None
+
+    quoted = ['"{0}"'.format(word.replace('"', '""')) for word in words]
+
+    return ' '.join(quoted) + '*'
+
+
+def build_tsquery_expression(terms):
+    """PostgreSQL counterpart of build_match_expression: turns user input into
+    a tsquery matching items that contain every word in it, the last one
+    also as a prefix. Only letters and digits are kept, so the result is
+    always valid tsquery syntax.
+
+    Args:
+        terms: Search string entered by user.
+
+    Returns:
+        tsquery string, or None if terms contains no words.
+    """
+
+    words = re.findall(r'[^\W_]+', terms)
+    if not words:
+        return None
+
+    return ' & '.join(words) + ':*'
+
+
+def search_items(terms, page=1, limit=20):
+    """Searches item names and descriptions using the full-text index. Results
+    are ranked by relevance (BM25 on SQLite), with matches in names weighted
+    ten times higher than matches in descriptions.
+
+    Args:
+        terms: Search string entered by user.
+        page: Number of page of results, starting at 1.
+        limit: Number of results per page.
+
+    Returns:
+        Tuple (results, has_more). results is a list of rows with ID, name,
+        description, and category ID; has_more is True if another page of
+        results follows.
+    """
+
+    if db_session.get_bind().dialect.name == 'postgresql':
+        search_sql, match = \
+            POSTGRESQL_SEARCH_SQL, build_tsquery_expression(terms)
+    else:
+        search_sql, match = SQLITE_SEARCH_SQL, build_match_expression(terms)
+
+    if match is None:
+        return [], False
+
+    results = db_session.execute(search_sql, {
+        'match': match,
+        'limit': limit + 1,
+        'offset': (page - 1) * limit
+    }).fetchall()
+
+    return results[:limit], len(results) > limit
+
+
+# Image helpers
+
+# Formats accepted for uploaded item images.
+UPLOAD_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif')
+
+def store_image(image_file):
+    """Saves uploaded image to image store and queues generation of its
+    resized variants in the background. The image's format is detected from
+    its first bytes; the file name and the browser-supplied content type are
+    ignored.
+
+    Args:
+        image_file: FileStorage of uploaded image.
+
+    Returns:
+        Key of stored image, or None if the upload isn't a JPEG, PNG or GIF
+        image.
+    """
+
+    stream = image_file.stream
+    header = stream.read(16)
+    stream.seek(0)
+    if guess_image_type(header) not in UPLOAD_IMAGE_TYPES:
+        return None
+
+    # Uploads received by UploadRequest were hashed as they arrived.
+    image_key = image_store.save_file(stream, getattr(stream, 'key', None))
+    image_processor.submit(image_key)
+
+    return image_key
+
+
+def release_image(image_key):
+    """Removes image from image store unless another item still uses it.
+    Should be called after the change dropping the image has been committed.
+
+    Args:
+        image_key: Key of image no longer used by an item; may be None.
+    """
+
+    if image_key is None:
+        return
+
+    in_use = db_session.query(CatalogItem.id) \
+        .filter_by(image_key=image_key) \
+        .first() is not None
+
+    if not in_use:
+        image_store.delete(image_key)
+        for size in VARIANT_WIDTHS:
+            image_store.delete(variant_key(image_key, size))
 
 
 # HTTP error helpers
@@ -162,6 +830,13 @@ def not_signed_in():
     return make_response('User must be signed in.', 401)
 
 
+def upload_too_large():
+    """Returns 413 HTTP response with message "Uploaded file is too large."
+    """
+
+    return make_response('Uploaded file is too large.', 413)
+
+
 def not_authorized():
     """Returns 401 HTTP response with message "User is not authorized to perform this
     action."
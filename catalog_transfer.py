@@ -0,0 +1,550 @@
+"""Bulk import and export of users, categories and items as JSON Lines or CSV.
+
+Each record describes one row and has a "type" field of "user", "category" or
+"item". Users are identified by their Google ID and categories and items by
+their IDs, so importing a file again updates the rows it created rather than
+adding duplicates. Item images are referenced by image store key; exports can
+copy the image files to a directory from which imports read them back.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, text
+
+from database_setup import CatalogChange, CatalogItem, CatalogVersion, \
+    Category, User
+
+# Number of records written per transaction while importing, and read per
+# query while exporting.
+TRANSFER_BATCH_SIZE = 5000
+
+# Columns of CSV files. Each record only fills in the columns of its type.
+CSV_FIELDS = ['type', 'id', 'google_id', 'name', 'email', 'picture',
+              'category_id', 'description', 'user', 'created_at', 'image']
+
+RECORD_FIELDS = {
+    'user': ['google_id', 'name', 'email', 'picture'],
+    'category': ['id', 'name'],
+    'item': ['id', 'category_id', 'name', 'description', 'user',
+             'created_at', 'image'],
+}
+
+REQUIRED_FIELDS = {
+    'user': ['google_id', 'name', 'email'],
+    'category': ['id', 'name'],
+    'item': ['id', 'category_id', 'name', 'description'],
+}
+
+# Image store keys are SHA-256 digests of the image. Keys read from import
+# files are used as file names, so anything else, including values that
+# aren't strings, is treated as a missing image rather than a path.
+IMAGE_KEY_PATTERN = re.compile(r'[0-9a-f]{64}\Z')
+
+# Number of values bound per "IN" list, below SQLite's historical limit of
+# 999 variables per statement.
+LOOKUP_CHUNK_SIZE = 500
+
+DATETIME_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                    '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S']
+
+
+class TransferStats(object):
+    """Counts of records transferred, for progress reports.
+
+    Attributes:
+        users: Number of user records.
+        categories: Number of category records.
+        items: Number of item records.
+        images: Number of image files copied.
+        missing_images: Number of item images that couldn't be found.
+        started_at: Time at which the transfer started.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.categories = 0
+        self.items = 0
+        self.images = 0
+        self.missing_images = 0
+        self.started_at = time.time()
+
+    @property
+    def rows(self):
+        return self.users + self.categories + self.items
+
+    def __str__(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+
+        return ('{0} users, {1} categories, {2} items and {3} images in '
+                '{4:.1f} s ({5:.0f} rows/s)').format(
+                    self.users, self.categories, self.items, self.images,
+                    elapsed, self.rows / elapsed)
+
+
+def guess_format(path):
+    """Returns "csv" for paths ending in .csv and "jsonl" otherwise."""
+
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, file_format):
+    """Parses records from a file one at a time.
+
+    Args:
+        stream: Text file object to read.
+        file_format: "jsonl" or "csv".
+
+    Yields:
+        Tuples (line_number, record), where record is a dictionary. Empty CSV
+        columns are left out of the record.
+    """
+
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), 2):
+            yield number, dict((name, value) for name, value in row.items()
+                               if name is not None and value != '')
+    else:
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as error:
+                    raise ValueError('line {0}: {1}'.format(number, error))
+
+
+def parse_datetime(value):
+    # fromisoformat, where available, is many times faster than strptime.
+    if hasattr(datetime, 'fromisoformat'):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            pass
+
+    raise ValueError('invalid date and time "{0}"'.format(value))
+
+
+def validate_record(number, record):
+    """Checks record has a known type and all fields required by it, and
+    converts field values to the types of their columns.
+
+    Returns:
+        Tuple (record_type, fields).
+    """
+
+    if not isinstance(record, dict):
+        raise ValueError('line {0}: record is not an object'.format(number))
+
+    record_type = record.get('type')
+    if record_type not in RECORD_FIELDS:
+        raise ValueError('line {0}: unknown record type "{1}"'.format(
+            number, record_type))
+
+    fields = dict((name, record.get(name))
+                  for name in RECORD_FIELDS[record_type])
+
+    missing = [name for name in REQUIRED_FIELDS[record_type]
+               if fields[name] is None]
+    if missing:
+        raise ValueError('line {0}: {1} record is missing {2}'.format(
+            number, record_type, ', '.join(missing)))
+
+    try:
+        for name in ('id', 'category_id'):
+            if fields.get(name) is not None:
+                fields[name] = int(fields[name])
+        if fields.get('created_at') is not None:
+            fields['created_at'] = parse_datetime(fields['created_at'])
+    except ValueError as error:
+        raise ValueError('line {0}: {1}'.format(number, error))
+
+    return record_type, fields
+
+
+def chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def existing_keys(connection, column, keys):
+    """Returns the subset of keys already present in column."""
+
+    # An expanding parameter is rendered at execution, which is much cheaper
+    # than compiling a statement with a literal IN list for every chunk.
+    query = select([column]).where(
+        column.in_(bindparam('keys', expanding=True)))
+
+    found = set()
+    for chunk in chunks(keys, LOOKUP_CHUNK_SIZE):
+        found.update(row[0] for row in connection.execute(query, keys=chunk))
+
+    return found
+
+
+def upsert(connection, table, key, rows):
+    """Inserts rows whose key isn't in table yet and updates the others, using
+    one multi-row statement for each.
+
+    Args:
+        connection: Connection with an open transaction.
+        table: Table to write.
+        key: Name of column identifying rows.
+        rows: List of dictionaries mapping column names to values.
+    """
+
+    if not rows:
+        return
+
+    existing = existing_keys(connection, table.c[key],
+                             set(row[key] for row in rows))
+
+    # Later records for the same key replace earlier ones in the batch.
+    latest = dict((row[key], row) for row in rows)
+    new = [row for row_key, row in latest.items() if row_key not in existing]
+    changed = [row for row_key, row in latest.items() if row_key in existing]
+
+    for columns, group in group_by_columns(new):
+        connection.execute(table.insert(), group)
+
+    # Parameters of an UPDATE can't share names with the columns it sets.
+    for columns, group in group_by_columns(changed):
+        statement = table.update() \
+            .where(table.c[key] == bindparam('_' + key)) \
+            .values(dict((name, bindparam('_' + name))
+                         for name in columns if name != key))
+        connection.execute(statement, [
+            dict(('_' + name, value) for name, value in row.items())
+            for row in group])
+
+
+def reset_id_sequence(connection, table):
+    """Moves PostgreSQL's ID sequence of table past the IDs written to it
+    explicitly, so that rows created later don't collide with imported ones.
+    Other databases pick the next ID from the table itself."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+        "coalesce(max(id), 0) + 1, false) FROM {0}".format(table.name)),
+        table=table.name)
+
+
+def change_row(entity, row, fields):
+    """Returns change log row recording that entity was imported as row."""
+
+    return {
+        'entity': entity,
+        'entity_id': row['id'],
+        'operation': 'upsert',
+        'data': json.dumps(dict((field, row[field]) for field in fields)),
+    }
+
+
+def group_by_columns(rows):
+    """Groups rows by the set of columns they have values for, since every
+    row of a multi-row statement must bind the same parameters."""
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    return groups.items()
+
+
+class CatalogImporter(object):
+    """Loads records into the catalog database in batches, each written in one
+    transaction. Users and categories in a batch are written before its items,
+    so items may refer to users and categories defined earlier in the same
+    file.
+
+    Attributes:
+        engine: Engine connected to the catalog database.
+        image_store: ImageStore receiving item images.
+        images_dir: Directory holding image files named by their keys, or
+                    None to only accept images already in the image store.
+        batch_size: Number of records written per transaction.
+        stats: TransferStats of the import.
+    """
+
+    def __init__(self, engine, image_store, images_dir=None,
+                 batch_size=TRANSFER_BATCH_SIZE):
+        self.engine = engine
+        self.image_store = image_store
+        self.images_dir = images_dir
+        self.batch_size = batch_size
+        self.stats = TransferStats()
+        self.user_ids = {}
+        self.pending = {'user': [], 'category': [], 'item': []}
+        self.pending_count = 0
+
+    def add(self, number, record):
+        """Queues record, writing the batch once it is full."""
+
+        record_type, fields = validate_record(number, record)
+        self.pending[record_type].append(fields)
+
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes queued records in one transaction."""
+
+        users = self.pending['user']
+        categories = self.pending['category']
+        items = self.pending['item']
+
+        with self.engine.begin() as connection:
+            if categories or items:
+                connection.execute(CatalogVersion.bump())
+
+            upsert(connection, User.__table__, 'google_id', users)
+            upsert(connection, Category.__table__, 'id', categories)
+            # Items' owners are looked up only now, so that users written
+            # above are found.
+            item_rows = [self.item_row(connection, item) for item in items]
+            upsert(connection, CatalogItem.__table__, 'id', item_rows)
+            if categories:
+                reset_id_sequence(connection, Category.__table__)
+            if items:
+                reset_id_sequence(connection, CatalogItem.__table__)
+
+            changes = [change_row('category', row, ('id', 'name'))
+                       for row in categories] + \
+                [change_row('item', row, ('id', 'name', 'description',
+                                          'category_id'))
+                 for row in item_rows]
+            if changes:
+                connection.execute(CatalogChange.__table__.insert(), changes)
+
+        self.stats.users += len(users)
+        self.stats.categories += len(categories)
+        self.stats.items += len(items)
+        self.pending = {'user': [], 'category': [], 'item': []}
+        self.pending_count = 0
+
+    def item_row(self, connection, item):
+        row = {
+            'id': item['id'],
+            'category_id': item['category_id'],
+            'name': item['name'],
+            'description': item['description'],
+            'user_id': self.get_user_id(connection, item['user']),
+            'image_key': self.import_image(item['image']),
+        }
+
+        # Items without a timestamp keep the one they were created with.
+        if item['created_at'] is not None:
+            row['created_at'] = item['created_at']
+
+        return row
+
+    def get_user_id(self, connection, google_id):
+        if google_id is None:
+            return None
+
+        user_id = self.user_ids.get(google_id)
+        if user_id is None:
+            # Users that don't exist (yet) aren't cached, as a later batch
+            # may still define them.
+            user_id = connection.execute(
+                select([User.id]).where(User.google_id == google_id)).scalar()
+            if user_id is not None:
+                self.user_ids[google_id] = user_id
+
+        return user_id
+
+    def import_image(self, key):
+        """Copies image into the image store.
+
+        Returns:
+            Key of stored image, or None if it couldn't be found.
+        """
+
+        if key is None:
+            return None
+
+        if not IMAGE_KEY_PATTERN.match(u'{0}'.format(key)):
+            self.stats.missing_images += 1
+            return None
+
+        path = os.path.join(self.images_dir, key) if self.images_dir else None
+        if path is not None and os.path.exists(path):
+            if self.image_store.exists(key):
+                return key
+
+            with open(path, 'rb') as image_file:
+                self.stats.images += 1
+                return self.image_store.save(image_file.read())
+
+        if self.image_store.exists(key):
+            return key
+
+        self.stats.missing_images += 1
+        return None
+
+
+def import_catalog(engine, image_store, stream, file_format, images_dir=None,
+                   batch_size=TRANSFER_BATCH_SIZE, progress=None):
+    """Imports records into the catalog database.
+
+    Args:
+        engine: Engine connected to the catalog database.
+        image_store: ImageStore receiving item images.
+        stream: Text file object to read records from.
+        file_format: "jsonl" or "csv".
+        images_dir: Directory holding exported image files.
+        batch_size: Number of records written per transaction.
+        progress: Function called with the TransferStats after every batch.
+
+    Returns:
+        TransferStats of the import.
+
+    Raises:
+        ValueError: A record is malformed. Batches before it stay imported.
+    """
+
+    importer = CatalogImporter(engine, image_store, images_dir, batch_size)
+
+    for number, record in read_records(stream, file_format):
+        importer.add(number, record)
+        if progress is not None and importer.pending_count == 0:
+            progress(importer.stats)
+
+    importer.flush()
+
+    return importer.stats
+
+
+def iter_table(engine, columns, batch_size, join=None):
+    """Yields rows of a table in batches ordered by the first of columns,
+    which must be unique."""
+
+    key = columns[0]
+    query = select(columns).order_by(key).limit(batch_size)
+    if join is not None:
+        query = query.select_from(join)
+
+    batch = engine.execute(query).fetchall()
+    while batch:
+        for row in batch:
+            yield row
+
+        if len(batch) < batch_size:
+            return
+
+        batch = engine.execute(query.where(key > batch[-1][0])).fetchall()
+
+
+def iter_records(engine, batch_size=TRANSFER_BATCH_SIZE):
+    """Yields every user, category and item as a record, in that order."""
+
+    users = [User.google_id, User.name, User.email, User.picture]
+    for user in iter_table(engine, users, batch_size):
+        yield dict(type='user', google_id=user.google_id, name=user.name,
+                   email=user.email, picture=user.picture)
+
+    for category in iter_table(engine, [Category.id, Category.name], batch_size):
+        yield dict(type='category', id=category.id, name=category.name)
+
+    items = [CatalogItem.id, CatalogItem.category_id, CatalogItem.name,
+             CatalogItem.description, User.google_id, CatalogItem.created_at,
+             CatalogItem.image_key]
+    join = CatalogItem.__table__.outerjoin(
+        User.__table__, CatalogItem.user_id == User.id)
+    for item in iter_table(engine, items, batch_size, join=join):
+        yield dict(type='item', id=item.id, category_id=item.category_id,
+                   name=item.name, description=item.description,
+                   user=item.google_id,
+                   created_at=item.created_at.isoformat()
+                   if item.created_at else None,
+                   image=item.image_key)
+
+
+def export_catalog(engine, image_store, stream, file_format, images_dir=None,
+                   batch_size=TRANSFER_BATCH_SIZE):
+    """Exports the catalog database as records.
+
+    Args:
+        engine: Engine connected to the catalog database.
+        image_store: ImageStore holding item images.
+        stream: Text file object to write records to.
+        file_format: "jsonl" or "csv".
+        images_dir: Directory to copy item images to, or None to leave them
+                    out.
+        batch_size: Number of rows read per query.
+
+    Returns:
+        TransferStats of the export.
+    """
+
+    stats = TransferStats()
+
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, CSV_FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(record):
+            stream.write(json.dumps(record) + '\n')
+
+    if images_dir is not None and not os.path.isdir(images_dir):
+        os.makedirs(images_dir)
+
+    for record in iter_records(engine, batch_size):
+        record = dict((name, value) for name, value in record.items()
+                      if value is not None)
+        write(record)
+
+        if record['type'] == 'user':
+            stats.users += 1
+        elif record['type'] == 'category':
+            stats.categories += 1
+        else:
+            stats.items += 1
+            if images_dir is not None and 'image' in record:
+                if copy_image(image_store, record['image'], images_dir):
+                    stats.images += 1
+
+    return stats
+
+
+def copy_image(image_store, key, images_dir):
+    """Copies stored image to images_dir, unless it was copied already.
+
+    Returns:
+        True if the image was copied.
+    """
+
+    path = os.path.join(images_dir, key)
+    if os.path.exists(path) or not image_store.exists(key):
+        return False
+
+    image_file = image_store.open(key)
+    try:
+        with open(path, 'wb') as output:
+            output.write(image_file.read())
+    finally:
+        image_file.close()
+
+    return True
+
+
+def open_records(path, mode):
+    """Opens records file as text, with the newline handling csv expects."""
+
+    return io.open(path, mode, encoding='utf-8', newline='')
@@ -0,0 +1,145 @@
+"""Application settings. Each value can be overridden with an environment
+variable of the same name.
+"""
+
+import os
+
+# SQLAlchemy URL of the catalog database.
+DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///catalog.db')
+
+# SQLAlchemy URL of a read-only replica of the catalog database, which pages
+# that only read from the database query instead of the primary. Unset, every
+# query goes to DATABASE_URI. Browsers whose session wrote to the database
+# within the last DATABASE_REPLICA_LAG seconds keep reading from the primary,
+# so that users see their own changes while the replica catches up.
+DATABASE_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URI') or None
+DATABASE_REPLICA_LAG = float(os.environ.get('DATABASE_REPLICA_LAG', 5))
+
+# Number of database connections kept open, the number that may be opened on
+# top of those at peak load, and seconds to wait for a free connection.
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+
+# Milliseconds a SQLite connection waits for another connection's lock, and
+# journal mode of SQLite databases. WAL lets reads run alongside a write.
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+
+# Dotted path of the class used to store item images.
+IMAGE_STORE_BACKEND = os.environ.get('IMAGE_STORE_BACKEND',
+                                     'image_store.LocalImageStore')
+
+# Directory in which LocalImageStore keeps item images.
+IMAGE_STORE_PATH = os.environ.get('IMAGE_STORE_PATH', 'images')
+
+# Seconds for which browsers and proxies may cache item images requested
+# through versioned URLs.
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 31536000))
+
+# Largest request body accepted, in bytes, which limits the size of uploaded
+# item images. Larger requests are rejected with 413 before they're read.
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH',
+                                        10 * 1024 * 1024))
+
+# Number of background threads generating resized variants of uploaded images.
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# Pillow format name and encoder quality (1-100) of resized image variants.
+IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'WEBP')
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+
+# If true, responses report the number of SQL statements run while handling
+# the request in an "X-Query-Count" header.
+QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', '') == '1'
+
+# Number of items listed per category page by default, and the most a client
+# may ask for with the "limit" parameter.
+CATEGORY_PAGE_SIZE = int(os.environ.get('CATEGORY_PAGE_SIZE', 50))
+CATEGORY_MAX_PAGE_SIZE = int(os.environ.get('CATEGORY_MAX_PAGE_SIZE', 500))
+
+# Number of search results per page by default, and the most a client may
+# ask for with the "limit" parameter.
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+
+# Number of pages rendered for visitors who aren't signed in that are kept in
+# memory (0 disables the cache), and seconds for which a cached page is used.
+# Cached pages are keyed by catalog version, so they stop being used as soon
+# as items change.
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1000))
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 60))
+
+# Number of rendered catalog exports (one per format and page) kept in
+# memory until the catalog changes, the most bytes they may take together,
+# compressed copies included, and seconds for which an unchanged export is
+# kept. Only whole catalogs and pages of EXPORT_PAGE_SIZE categories are
+# cached; other pages, and exports too large for the cache, are streamed
+# uncompressed. EXPORT_CACHE_SIZE = 0 disables the cache.
+EXPORT_CACHE_SIZE = int(os.environ.get('EXPORT_CACHE_SIZE', 16))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES',
+                                            64 * 1024 * 1024))
+EXPORT_CACHE_TTL = int(os.environ.get('EXPORT_CACHE_TTL', 3600))
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 100))
+
+# Number of changes per response of /catalog/changes by default, and the most
+# a client may ask for with the "limit" parameter.
+CHANGES_PAGE_SIZE = int(os.environ.get('CHANGES_PAGE_SIZE', 100))
+CHANGES_MAX_PAGE_SIZE = int(os.environ.get('CHANGES_MAX_PAGE_SIZE', 1000))
+
+# If true, changes are also streamed as Server-Sent Events on
+# /catalog/changes/stream. Each open stream occupies a server thread, polling
+# for changes every CHANGE_STREAM_POLL_INTERVAL seconds, for up to
+# CHANGE_STREAM_TIMEOUT seconds before the client has to reconnect, so it's
+# off by default: a few clients could tie up every thread of a small server.
+CHANGE_STREAM_ENABLED = os.environ.get('CHANGE_STREAM_ENABLED', '0') == '1'
+CHANGE_STREAM_POLL_INTERVAL = float(
+    os.environ.get('CHANGE_STREAM_POLL_INTERVAL', 1))
+CHANGE_STREAM_TIMEOUT = int(os.environ.get('CHANGE_STREAM_TIMEOUT', 300))
+
+# Most create, update and delete operations accepted by one request to the
+# batch endpoint, /catalog/items/batch.
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 1000))
+
+# Path of the OAuth2 client secrets downloaded from the Google API Console.
+CLIENT_SECRETS_FILE = os.environ.get('CLIENT_SECRETS_FILE',
+                                     'client_secrets.json')
+
+# Google endpoints used when signing users in and out.
+GOOGLE_TOKENINFO_URL = os.environ.get(
+    'GOOGLE_TOKENINFO_URL', 'https://www.googleapis.com/oauth2/v1/tokeninfo')
+GOOGLE_USERINFO_URL = os.environ.get(
+    'GOOGLE_USERINFO_URL', 'https://www.googleapis.com/oauth2/v1/userinfo')
+GOOGLE_REVOKE_URL = os.environ.get(
+    'GOOGLE_REVOKE_URL', 'https://accounts.google.com/o/oauth2/revoke')
+
+# Seconds to wait for Google to connect or respond, number of times a failed
+# request is retried, and number of connections kept open to each Google host.
+GOOGLE_HTTP_TIMEOUT = float(os.environ.get('GOOGLE_HTTP_TIMEOUT', 5))
+GOOGLE_HTTP_RETRIES = int(os.environ.get('GOOGLE_HTTP_RETRIES', 2))
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get('GOOGLE_HTTP_POOL_SIZE', 10))
+
+# Dotted path of the class storing session contents on the server; the
+# session cookie holds only the session ID. MemorySessionStore keeps sessions
+# in memory, DatabaseSessionStore in the catalog database, which is needed
+# when running more than one application process.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND',
+                                 'session_store.MemorySessionStore')
+
+# Number of sessions MemorySessionStore keeps before dropping the least
+# recently used.
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+
+# Number of signed-in users whose profiles are kept in memory, and seconds
+# for which a cached profile is used. A user's profile is dropped from cache
+# when it changes on sign-in.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+# If true, request metrics are served in the Prometheus text format on
+# /metrics.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Requests taking at least this many seconds are logged along with their
+# slowest SQL statements; 0 disables the log.
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))
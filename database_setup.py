@@ -1,7 +1,17 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, func, DateTime, Binary
+import os
+import threading
+
+from sqlalchemy import Column, ForeignKey, Integer, String, Text, func, \
+    DateTime, LargeBinary
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, deferred, sessionmaker, \
+    scoped_session, Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import create_engine, event, DDL
+
+import config
 
 Base = declarative_base()
 
@@ -20,12 +30,94 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    google_id = Column(String(80), nullable=False)
+    google_id = Column(String(80), nullable=False, unique=True, index=True)
     name = Column(String(250), nullable=False)
     email = Column(String(250), nullable=False)
     picture = Column(String(250))
 
 
+class UserSession(Base):
+    """Class for storing contents of server-side sessions.
+
+    Attributes:
+        id: Session ID, as sent in the session cookie.
+        data: Serialized session contents.
+        expires_at: Time after which session is no longer valid.
+    """
+
+    __tablename__ = "sessions"
+
+    id = Column(String(64), primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class CatalogVersion(Base):
+    """Class for the single row counting changes to the catalog, so that
+    clients polling the catalog can be told whether it changed without
+    reading the items table.
+
+    Attributes:
+        id: Always 1.
+        version: Number incremented by every change to categories or items.
+        updated_at: Time of the latest change.
+        pruned_seq: Sequence number of the latest change pruned from the
+                    change log, or 0 if none has been.
+    """
+
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    pruned_seq = Column(Integer, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def bump(cls):
+        """Returns statement incrementing the version. Must be the first write
+        of the transaction that changes the catalog, before it locks category
+        rows or appends to the change log: the row lock it takes until commit
+        serializes catalog writes, so writers can't deadlock on categories and
+        change sequence numbers are committed in order."""
+
+        return cls.__table__.update() \
+            .values(version=cls.version + 1, updated_at=func.now())
+
+
+CATALOG_VERSION_DDL = """INSERT INTO catalog_version (id, version, updated_at)
+    VALUES (1, 1, CURRENT_TIMESTAMP)"""
+
+event.listen(CatalogVersion.__table__, 'after_create',
+             DDL(CATALOG_VERSION_DDL))
+
+
+class CatalogChange(Base):
+    """Class for storing the append-only log of changes to categories and
+    items, which clients use to sync their copies of the catalog.
+
+    Attributes:
+        seq: Sequence number of change, increasing in commit order.
+        entity: "category" or "item".
+        entity_id: ID of changed category or item.
+        operation: "upsert" for created or updated entities, "delete" for
+                   deleted ones.
+        data: JSON of entity after the change, or None for deletes.
+        changed_at: Time at which change was made.
+    """
+
+    __tablename__ = "catalog_changes"
+    # Without AUTOINCREMENT, SQLite reuses the numbers of deleted rows once
+    # the log is pruned empty, and clients would skip the reused ones.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String(16), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(16), nullable=False)
+    data = Column(Text, nullable=True)
+    changed_at = Column(DateTime, default=func.now(), index=True)
+
+
 class CatalogItem(Base):
     """Class for storing catalog items.
 
@@ -37,14 +129,16 @@ class CatalogItem(Base):
         user: User who created item.
         user_id: ID of user who created item.
         created_at: Time at which item was inserted into the database.
-        image_blob: Blob containing image of item
-                    submitted with item's name and description.
+        image_key: Key of item's image in the image store, or None if item
+                   has no image.
+        image_blob: Legacy blob containing image of item. Only read when
+                    migrating images into the image store.
     """
 
     __tablename__ = "items"
 
     id = Column(Integer, primary_key=True)
-    category_id = Column(Integer, ForeignKey('categories.id'))
+    category_id = Column(Integer, ForeignKey('categories.id'), index=True)
 
     name = Column(String(80), nullable=False)
     description = Column(String(500), nullable=False)
@@ -52,18 +146,23 @@ class CatalogItem(Base):
     user = relationship("User")
     user_id = Column(Integer, ForeignKey('users.id'))
 
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=func.now(), index=True)
+
+    image_key = Column(String(64), nullable=True, index=True)
+
+    image_blob = deferred(Column(LargeBinary, nullable=True))
 
-    image_blob = Column(Binary, nullable=True)
+    @hybrid_property
+    def has_image(self):
+        """True if item has an image in the image store. Also usable in
+        queries, e.g. to list items along with the flag without loading
+        anything else."""
 
-    # Convert to dictionary for JSON/XML serialization.
-    @property
-    def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description
-        }
+        return self.image_key is not None
+
+    @has_image.expression
+    def has_image(cls):
+        return cls.image_key.isnot(None)
 
 
 class Category(Base):
@@ -72,6 +171,9 @@ class Category(Base):
     Attributes:
         id: Unique category key.
         name: Name of category.
+        item_count: Number of items in category. Kept up to date by the
+                    application whenever items are written, so listing
+                    categories never needs to count the items table.
         items: Items belonging to category.
 
     """
@@ -79,18 +181,210 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
+    item_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     items = relationship("CatalogItem", backref="category")
 
-    # Convert to dictionary for JSON/XML serialization.
-    @property
-    def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'items': [item.serialize for item in self.items]
-        }
 
-engine = create_engine('sqlite:///catalog.db')
+# Full-text index of item names and descriptions, stored as an SQLite FTS5
+# table whose content is read from the items table. Triggers keep the index
+# in sync with every insert, update and delete on items, whichever code path
+# makes the change.
+ITEMS_FTS_DDL = [
+    """CREATE VIRTUAL TABLE items_fts USING fts5(
+        name, description,
+        content='items', content_rowid='id',
+        tokenize='porter unicode61')""",
+    """CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts (rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER items_fts_update AFTER UPDATE OF name, description
+    ON items BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO items_fts (rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+for statement in ITEMS_FTS_DDL:
+    event.listen(CatalogItem.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+# On PostgreSQL, items are searched with the built-in text search instead,
+# through a GIN index of the same expression the search query matches on.
+ITEMS_TSVECTOR_INDEX_DDL = """CREATE INDEX ix_items_search ON items
+    USING gin (to_tsvector('english', name || ' ' || description))"""
+
+event.listen(CatalogItem.__table__, 'after_create',
+             DDL(ITEMS_TSVECTOR_INDEX_DDL).execute_if(dialect='postgresql'))
+
+
+def create_db_engine(url, pool_size=5, max_overflow=10, pool_timeout=30,
+                     sqlite_busy_timeout=5000, sqlite_journal_mode='WAL'):
+    """Creates engine with a pool of connections shared by all threads.
+
+    SQLite databases are switched to the given journal mode; in WAL mode
+    readers don't block the writer or each other. Instead of failing at once
+    with "database is locked", connections wait up to sqlite_busy_timeout
+    milliseconds for another connection's write to finish.
+
+    Args:
+        url: Database URL.
+        pool_size: Number of connections kept open in the pool.
+        max_overflow: Number of connections opened beyond pool_size at peak.
+        pool_timeout: Seconds to wait for a free connection before failing.
+        sqlite_busy_timeout: Milliseconds SQLite waits for a lock.
+        sqlite_journal_mode: SQLite journal mode, e.g. "WAL" or "DELETE".
+
+    Returns:
+        Engine instance.
+    """
+
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        # Connections dropped by the server, e.g. when a replica restarts,
+        # are replaced instead of failing the next request that uses them.
+        return create_engine(url, pool_size=pool_size,
+                             max_overflow=max_overflow,
+                             pool_timeout=pool_timeout,
+                             pool_pre_ping=True)
+
+    options = {
+        'connect_args': {'timeout': sqlite_busy_timeout / 1000.0}
+    }
+
+    # In-memory databases exist per connection, so they can't be pooled.
+    if url.database and url.database != ':memory:':
+        options.update(poolclass=QueuePool,
+                       pool_size=pool_size,
+                       max_overflow=max_overflow,
+                       pool_timeout=pool_timeout)
+        # Pooled connections are handed from thread to thread, but never
+        # used by two threads at once.
+        options['connect_args']['check_same_thread'] = False
+
+    engine = create_engine(url, **options)
+
+    @event.listens_for(engine, 'connect')
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode = {0}'.format(sqlite_journal_mode))
+        cursor.execute('PRAGMA busy_timeout = {0:d}'.format(sqlite_busy_timeout))
+        # With WAL, NORMAL only syncs at checkpoints and is still safe
+        # against corruption.
+        if sqlite_journal_mode.upper() == 'WAL':
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
+
+    return engine
+
+
+def create_configured_engine(url, settings):
+    return create_db_engine(url,
+                            pool_size=settings['DATABASE_POOL_SIZE'],
+                            max_overflow=settings['DATABASE_MAX_OVERFLOW'],
+                            pool_timeout=settings['DATABASE_POOL_TIMEOUT'],
+                            sqlite_busy_timeout=settings['SQLITE_BUSY_TIMEOUT'],
+                            sqlite_journal_mode=settings['SQLITE_JOURNAL_MODE'])
+
+
+# Engines are created on first use, from the settings last passed to
+# configure_engines() (config.py's by default). Importing this module doesn't
+# touch the database, and workers forked by a prefork server create their own
+# connection pools instead of sharing their parent's.
+engine_settings = vars(config)
+engines = {}
+engines_lock = threading.Lock()
+
+# Engines a forked process inherited from its parent. They are kept, unused,
+# rather than disposed of, as closing their connections would close the
+# parent's as well.
+inherited_engines = []
+
+
+def configure_engines(settings):
+    """Sets the settings engines are created with. Engines created with
+    earlier settings are disposed of.
+
+    Args:
+        settings: Mapping of configuration values, such as app.config.
+    """
+
+    global engine_settings
+
+    with engines_lock:
+        engine_settings = settings
+        for engine in engines.values():
+            engine.dispose()
+        engines.clear()
+
+
+def get_engine():
+    """Returns engine connected to the primary database at DATABASE_URI,
+    creating it on first use.
+    """
+
+    return get_named_engine('DATABASE_URI')
+
+
+def get_replica_engine():
+    """Returns engine connected to the read replica at DATABASE_REPLICA_URI,
+    or the primary engine if there is no replica.
+    """
+
+    if not engine_settings['DATABASE_REPLICA_URI']:
+        return get_engine()
+
+    return get_named_engine('DATABASE_REPLICA_URI')
+
+
+def get_named_engine(name):
+    engine = engines.get(name)
+    if engine is None:
+        with engines_lock:
+            engine = engines.get(name)
+            if engine is None:
+                engine = create_configured_engine(engine_settings[name],
+                                                  engine_settings)
+                engines[name] = engine
+
+    return engine
+
+
+def forget_inherited_engines():
+    global engines_lock
+
+    inherited_engines.extend(engines.values())
+    engines.clear()
+    # The lock may have been held by another thread of the parent.
+    engines_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_inherited_engines)
+
+
+class RoutingSession(Session):
+    """Session reading from the replica engine once marked read-only by
+    setting info['read_only']. Writes, and everything in sessions not marked
+    read-only, go to the primary engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get('read_only') and not self._flushing:
+            return get_replica_engine()
+
+        return get_engine()
+
 
-Base.metadata.create_all(engine)
+# Database session shared by the application and its helpers. Each thread
+# gets its own session, which the application discards at the end of every
+# request, so concurrent requests never share a transaction.
+DBSession = sessionmaker(class_=RoutingSession)
+db_session = scoped_session(DBSession)
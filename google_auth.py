@@ -0,0 +1,130 @@
+import socket
+
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class GoogleUnavailable(Exception):
+    """Raised when Google can't be reached or doesn't answer in time."""
+
+
+class GoogleClient(object):
+    """Makes the requests to Google needed to sign users in. Requests go through
+    one pool of keep-alive connections shared by all threads, so only the
+    first request to each host pays for the TCP and TLS handshakes, and every
+    request is bounded by a timeout so a slow response can't hold up a worker
+    indefinitely. Failed connections and 5xx responses are retried.
+
+    Attributes:
+        tokeninfo_url: URL of Google's token information endpoint.
+        userinfo_url: URL of Google's user profile endpoint.
+        revoke_url: URL of Google's token revocation endpoint.
+        timeout: Seconds to wait for Google to connect or respond.
+    """
+
+    def __init__(self, tokeninfo_url, userinfo_url, revoke_url, timeout=5,
+                 retries=2, pool_size=10):
+        self.tokeninfo_url = tokeninfo_url
+        self.userinfo_url = userinfo_url
+        self.revoke_url = revoke_url
+        self.timeout = timeout
+
+        retry = Retry(total=retries, backoff_factor=0.1,
+                      status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.http = requests.Session()
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(tokeninfo_url=config['GOOGLE_TOKENINFO_URL'],
+                   userinfo_url=config['GOOGLE_USERINFO_URL'],
+                   revoke_url=config['GOOGLE_REVOKE_URL'],
+                   timeout=config['GOOGLE_HTTP_TIMEOUT'],
+                   retries=config['GOOGLE_HTTP_RETRIES'],
+                   pool_size=config['GOOGLE_HTTP_POOL_SIZE'])
+
+    def exchange_code(self, flow, code):
+        """Exchanges one-time authorization code for credentials.
+
+        Args:
+            flow: oauth2client Flow created from the client secrets.
+            code: Authorization code sent by the sign-in button.
+
+        Returns:
+            oauth2client Credentials.
+
+        Raises:
+            FlowExchangeError: Google rejected the code.
+            GoogleUnavailable: Google couldn't be reached.
+        """
+
+        # Imported here, along with oauth2client, rather than at startup.
+        import httplib2
+
+        # oauth2client only speaks httplib2, whose connections aren't safe to
+        # share between threads, so this request gets a connection of its own.
+        http = httplib2.Http(timeout=self.timeout)
+
+        try:
+            return flow.step2_exchange(code, http=http)
+        except (socket.error, httplib2.HttpLib2Error) as error:
+            raise GoogleUnavailable(str(error))
+
+    def get_token_and_user_info(self, access_token):
+        """Looks up information about an access token and the profile of the
+        user it was issued for. Both requests are made at the same time.
+
+        Args:
+            access_token: OAuth2 access token.
+
+        Returns:
+            Tuple of token information and user profile, as dictionaries. The
+            token information has an "error" key if the token is invalid.
+
+        Raises:
+            GoogleUnavailable: Google couldn't be reached.
+        """
+
+        tokeninfo = self.executor.submit(
+            self._get_json, self.tokeninfo_url, {'access_token': access_token})
+        userinfo = self.executor.submit(
+            self._get_json, self.userinfo_url,
+            {'access_token': access_token, 'alt': 'json'})
+
+        return tokeninfo.result(), userinfo.result()
+
+    def revoke_token(self, token):
+        """Revokes access or refresh token.
+
+        Args:
+            token: Token to revoke.
+
+        Returns:
+            True if Google revoked the token.
+
+        Raises:
+            GoogleUnavailable: Google couldn't be reached.
+        """
+
+        try:
+            response = self.http.get(self.revoke_url, params={'token': token},
+                                     timeout=self.timeout)
+        except requests.RequestException as error:
+            raise GoogleUnavailable(str(error))
+
+        return response.status_code == 200
+
+    def _get_json(self, url, params):
+        try:
+            response = self.http.get(url, params=params, timeout=self.timeout)
+            return response.json()
+        except (requests.RequestException, ValueError) as error:
+            raise GoogleUnavailable(str(error))
@@ -0,0 +1,152 @@
+import io
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Maximum width in pixels of each resized image variant. Images narrower than
+# this are re-encoded but not enlarged.
+VARIANT_WIDTHS = {
+    'thumbnail': 150,
+    'medium': 600,
+}
+
+# Name of the unmodified uploaded image.
+ORIGINAL = 'original'
+
+IMAGE_SIZES = [ORIGINAL] + sorted(VARIANT_WIDTHS)
+
+
+def variant_key(image_key, size):
+    """Returns image store key of a resized variant of an image. Variants are
+    derived deterministically from their source, so items sharing an image
+    also share its variants.
+
+    Args:
+        image_key: Key of original image.
+        size: One of IMAGE_SIZES.
+    """
+
+    if size == ORIGINAL:
+        return image_key
+
+    return '{0}-{1}'.format(image_key, size)
+
+
+def resize_image(data, width, image_format='WEBP', quality=80):
+    """Scales image down to width and re-encodes it.
+
+    Args:
+        data: Image contents as a byte string.
+        width: Maximum width of resized image; aspect ratio is preserved.
+        image_format: Pillow format name of resized image.
+        quality: Encoder quality setting, 1-100.
+
+    Returns:
+        Encoded resized image as a byte string.
+    """
+
+    image = Image.open(io.BytesIO(data))
+
+    # Phone cameras store rotation in EXIF metadata, which is dropped below.
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    if image.width > width:
+        height = max(1, int(round(image.height * width / float(image.width))))
+        image = image.resize((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, image_format, quality=quality)
+
+    return output.getvalue()
+
+
+def generate_variants(image_store, image_key, image_format='WEBP', quality=80):
+    """Creates any missing resized variants of a stored image.
+
+    Args:
+        image_store: ImageStore holding the image.
+        image_key: Key of original image.
+        image_format: Pillow format name of resized variants.
+        quality: Encoder quality setting, 1-100.
+
+    Returns:
+        List of sizes generated.
+    """
+
+    missing = [size for size in sorted(VARIANT_WIDTHS)
+               if not image_store.exists(variant_key(image_key, size))]
+    if not missing:
+        return []
+
+    image_file = image_store.open(image_key)
+    try:
+        data = image_file.read()
+    finally:
+        image_file.close()
+
+    for size in missing:
+        resized = resize_image(data, VARIANT_WIDTHS[size], image_format, quality)
+        image_store.save(resized, key=variant_key(image_key, size))
+
+    return missing
+
+
+class ImageProcessor(object):
+    """Generates image variants on a pool of background threads, so requests
+    uploading images don't wait for them to be decoded and resized. Pillow
+    releases the GIL while decoding and resampling, so threads run in
+    parallel.
+
+    Attributes:
+        image_store: ImageStore holding the images.
+        image_format: Pillow format name of resized variants.
+        quality: Encoder quality setting, 1-100.
+    """
+
+    def __init__(self, image_store, workers=2, image_format='WEBP', quality=80):
+        self.image_store = image_store
+        self.image_format = image_format
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    @classmethod
+    def from_config(cls, image_store, config):
+        return cls(image_store,
+                   workers=config['IMAGE_WORKERS'],
+                   image_format=config['IMAGE_VARIANT_FORMAT'],
+                   quality=config['IMAGE_VARIANT_QUALITY'])
+
+    def submit(self, image_key):
+        """Queues generation of variants for an image.
+
+        Args:
+            image_key: Key of original image.
+
+        Returns:
+            Future resolving to the list of sizes generated.
+        """
+
+        return self.executor.submit(self._generate, image_key)
+
+    def shutdown(self, wait=True):
+        """Stops worker threads, by default after queued images are done.
+        """
+
+        self.executor.shutdown(wait=wait)
+
+    def _generate(self, image_key):
+        try:
+            return generate_variants(self.image_store, image_key,
+                                     self.image_format, self.quality)
+        except Exception:
+            # Requests for a missing variant fall back to the original, so a
+            # file Pillow can't decode is logged rather than treated as fatal.
+            logger.exception('Failed to generate variants of image %s',
+                             image_key)
+            return []
@@ -0,0 +1,244 @@
+import hashlib
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from werkzeug.utils import import_string
+
+# Number of bytes copied at a time when saving images from files.
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class ImageStore(object):
+    """Interface for item image storage backends. Images are addressed by the
+    SHA-256 hex digest of their content, so identical images are stored only
+    once no matter how many items use them.
+    """
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates store instance from application configuration.
+
+        Args:
+            config: Mapping of configuration values.
+        """
+
+        raise NotImplementedError
+
+    def save(self, data, key=None):
+        """Stores image data.
+
+        Args:
+            data: Image contents as a byte string.
+            key: Key to store image under. Defaults to the SHA-256 digest of
+                 data; derived images such as resized variants pass a key
+                 built from their source image's key instead.
+
+        Returns:
+            Key under which image was stored.
+        """
+
+        raise NotImplementedError
+
+    def save_file(self, stream, key=None):
+        """Stores image read from a file object. Backends that can copy the
+        file in chunks override this to avoid holding the image in memory.
+
+        Args:
+            stream: Readable binary file object positioned at the start of
+                    the image.
+            key: Key to store image under; defaults to the SHA-256 digest of
+                 the image, as with save().
+
+        Returns:
+            Key under which image was stored.
+        """
+
+        return self.save(stream.read(), key)
+
+    def open(self, key):
+        """Opens stored image for reading.
+
+        Args:
+            key: Key of image.
+
+        Returns:
+            Readable binary file object.
+        """
+
+        raise NotImplementedError
+
+    def path(self, key):
+        """Returns local filesystem path of stored image, or None if backend
+        does not keep images on the local filesystem. Images with a path can
+        be handed straight to the web server for zero-copy sending.
+
+        Args:
+            key: Key of image.
+        """
+
+        return None
+
+    def exists(self, key):
+        """Returns True if an image with key is stored; otherwise False.
+        """
+
+        raise NotImplementedError
+
+    def content_type(self, key):
+        """Detects MIME type of stored image from its first few bytes.
+
+        Args:
+            key: Key of image.
+
+        Returns:
+            MIME type string, or None if image format is not recognized.
+        """
+
+        image_file = self.open(key)
+        try:
+            return guess_image_type(image_file.read(16))
+        finally:
+            image_file.close()
+
+    def modified_at(self, key):
+        """Returns UTC datetime at which image was stored, or None if backend
+        does not track it.
+
+        Args:
+            key: Key of image.
+        """
+
+        return None
+
+    def delete(self, key):
+        """Removes stored image. Removing a missing image is not an error.
+
+        Args:
+            key: Key of image.
+        """
+
+        raise NotImplementedError
+
+
+class LocalImageStore(ImageStore):
+    """Stores images as files in a local directory tree. Files are named by
+    their SHA-256 digest and fanned out into two levels of subdirectories,
+    e.g. "ab/cd/abcd...", to keep directories small.
+
+    Attributes:
+        root: Directory containing stored images.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['IMAGE_STORE_PATH'])
+
+    def save(self, data, key=None):
+        if key is None:
+            key = hashlib.sha256(data).hexdigest()
+
+        return self.save_file(io.BytesIO(data), key)
+
+    def save_file(self, stream, key=None):
+        if key is not None and self.exists(key):
+            return key
+
+        make_directory(self.root)
+
+        # Write to a temporary file first and rename it into place, so readers
+        # never see a partially written image. Without a key, the image is
+        # hashed as it is copied.
+        fd, temp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                    if key is None:
+                        digest.update(chunk)
+                    temp_file.write(chunk)
+
+            if key is None:
+                key = digest.hexdigest()
+            path = self.path(key)
+
+            make_directory(os.path.dirname(path))
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        return key
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def modified_at(self, key):
+        return datetime.utcfromtimestamp(int(os.path.getmtime(self.path(key))))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+
+def make_directory(directory):
+    """Creates directory and any missing parents unless it already exists.
+    """
+
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Directory may have been created by a concurrent save.
+            if not os.path.isdir(directory):
+                raise
+
+
+def guess_image_type(header):
+    """Identifies image format from the magic bytes at the start of a file.
+
+    Args:
+        header: At least the first 12 bytes of the image.
+
+    Returns:
+        MIME type string, or None if format is not recognized.
+    """
+
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+
+    return None
+
+
+def create_image_store(config):
+    """Creates image store using backend class named by the IMAGE_STORE_BACKEND
+    configuration value.
+
+    Args:
+        config: Mapping of configuration values.
+
+    Returns:
+        ImageStore instance.
+    """
+
+    backend = import_string(config['IMAGE_STORE_BACKEND'])
+
+    return backend.from_config(config)
@@ -0,0 +1,514 @@
+"""Maintenance commands for the catalog database.
+
+Usage:
+    python manage.py upgrade-db
+    python manage.py migrate-images [--batch-size N] [--vacuum]
+    python manage.py generate-variants
+    python manage.py rebuild-counts
+    python manage.py rebuild-search-index
+    python manage.py purge-sessions
+    python manage.py prune-changes [--keep-days N]
+    python manage.py import-catalog FILE [--format jsonl|csv] [--images DIR]
+                                         [--batch-size N]
+    python manage.py export-catalog FILE [--format jsonl|csv] [--images DIR]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from flask import Config
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, func, \
+    inspect, select
+from sqlalchemy.orm import sessionmaker
+
+from catalog_transfer import export_catalog, guess_format, import_catalog, \
+    open_records, TRANSFER_BATCH_SIZE
+from database_setup import CatalogChange, CatalogItem, CatalogVersion, \
+    Category, UserSession, Base, configure_engines, get_engine, \
+    ITEMS_FTS_DDL, ITEMS_TSVECTOR_INDEX_DDL
+from image_processing import ImageProcessor
+from image_store import create_image_store
+from session_store import DatabaseSessionStore
+
+
+def load_config():
+    """Loads application configuration without importing the application.
+    """
+
+    config = Config('.')
+    config.from_object('config')
+
+    return config
+
+
+# Schema migrations
+#
+# upgrade_db creates missing tables with create_all, but doesn't change
+# existing ones, so databases created by older versions of the application
+# are brought up to date by the migrations below.
+# Each one checks what is already there before changing anything, because
+# databases created from the current schema already have every column and
+# index.
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('applied_at', DateTime, nullable=False, default=func.now()))
+
+
+def add_missing_column(connection, table, column, definition):
+    """Adds column to an existing table if it isn't there yet.
+
+    Args:
+        connection: Connection to the catalog database.
+        table: Name of table.
+        column: Name of column.
+        definition: SQL type and constraints of column.
+
+    Returns:
+        True if column was added; otherwise False.
+    """
+
+    columns = [info['name'] for info in inspect(connection).get_columns(table)]
+    if column in columns:
+        return False
+
+    connection.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+        table, column, definition))
+
+    return True
+
+
+def add_missing_index(connection, table, name, columns, unique=False):
+    """Creates index on an existing table if it isn't there yet.
+
+    Args:
+        connection: Connection to the catalog database.
+        table: Name of table.
+        name: Name of index.
+        columns: List of indexed column names.
+        unique: If True, index enforces uniqueness of its columns.
+
+    Returns:
+        True if index was created; otherwise False.
+    """
+
+    indexes = [info['name'] for info in inspect(connection).get_indexes(table)]
+    if name in indexes:
+        return False
+
+    connection.execute('CREATE {0}INDEX {1} ON {2} ({3})'.format(
+        'UNIQUE ' if unique else '', name, table, ', '.join(columns)))
+
+    return True
+
+
+def add_image_key(connection):
+    """Adds items.image_key, referencing images in the image store."""
+
+    add_missing_column(connection, 'items', 'image_key', 'VARCHAR(64)')
+    add_missing_index(connection, 'items', 'ix_items_image_key', ['image_key'])
+
+
+def add_item_count(connection):
+    """Adds categories.item_count, caching the number of items per category."""
+
+    if add_missing_column(connection, 'categories', 'item_count',
+                          'INTEGER NOT NULL DEFAULT 0'):
+        rebuild_category_counts(connection)
+
+
+def add_lookup_indexes(connection):
+    """Indexes columns looked up on hot paths.
+
+    Users are looked up by Google ID on every authenticated request, items by
+    category on category pages, and items by creation time for the latest
+    items on the home page.
+    """
+
+    add_missing_index(connection, 'users', 'ix_users_google_id',
+                      ['google_id'], unique=True)
+    add_missing_index(connection, 'items', 'ix_items_category_id',
+                      ['category_id'])
+    add_missing_index(connection, 'items', 'ix_items_created_at',
+                      ['created_at'])
+
+
+def add_item_search_index(connection):
+    """Adds full-text search index of item names and descriptions."""
+
+    if connection.dialect.name != 'sqlite':
+        return
+
+    if 'items_fts' in inspect(connection).get_table_names():
+        return
+
+    for statement in ITEMS_FTS_DDL:
+        connection.execute(statement)
+    rebuild_search_index(connection)
+
+
+def add_sessions_table(connection):
+    """Adds table holding server-side sessions."""
+
+    UserSession.__table__.create(connection, checkfirst=True)
+
+
+def add_postgresql_search_index(connection):
+    """Adds full-text search index of items on PostgreSQL."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    indexes = inspect(connection).get_indexes('items')
+    if 'ix_items_search' not in [info['name'] for info in indexes]:
+        connection.execute(ITEMS_TSVECTOR_INDEX_DDL)
+
+
+def add_catalog_version(connection):
+    """Adds table counting changes to the catalog, for conditional exports."""
+
+    CatalogVersion.__table__.create(connection, checkfirst=True)
+
+
+def add_change_log(connection):
+    """Adds append-only log of changes to categories and items."""
+
+    CatalogChange.__table__.create(connection, checkfirst=True)
+    add_missing_column(connection, 'catalog_version', 'pruned_seq',
+                       'INTEGER NOT NULL DEFAULT 0')
+
+
+# Migrations in the order they were introduced. Never renumber or remove
+# entries; append new migrations to the end.
+MIGRATIONS = [
+    (1, add_image_key),
+    (2, add_item_count),
+    (3, add_lookup_indexes),
+    (4, add_item_search_index),
+    (5, add_sessions_table),
+    (6, add_postgresql_search_index),
+    (7, add_catalog_version),
+    (8, add_change_log),
+]
+
+
+def upgrade_db(engine):
+    """Creates tables missing from the database, then applies schema
+    migrations that haven't been applied to it yet. Each migration runs in
+    its own transaction together with the record of it having been applied.
+    The application never changes the schema itself, so this must be run
+    before it is first started against a database.
+
+    Args:
+        engine: Engine connected to the catalog database.
+
+    Returns:
+        List of versions applied.
+    """
+
+    Base.metadata.create_all(engine)
+    schema_migrations.create(engine, checkfirst=True)
+
+    applied = set(row.version for row in
+                  engine.execute(select([schema_migrations.c.version])))
+    upgraded = []
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version))
+
+        print('Applied migration {0}: {1}'.format(
+            version, migration.__doc__.splitlines()[0]))
+        upgraded.append(version)
+
+    return upgraded
+
+
+# Data maintenance
+
+
+def migrate_images(engine, image_store, batch_size=100, vacuum=False):
+    """Moves item images stored as blobs in the items table into the image
+    store. Items are processed in batches, each committed on its own, so the
+    migration can be interrupted and resumed.
+
+    Args:
+        engine: Engine connected to the catalog database.
+        image_store: ImageStore receiving the images.
+        batch_size: Number of items migrated per transaction.
+        vacuum: If True, compact the database file afterwards to return the
+                space freed by the blobs.
+
+    Returns:
+        Number of images migrated.
+    """
+
+    db_session = sessionmaker(bind=engine)()
+    migrated = 0
+
+    while True:
+        items = db_session.query(CatalogItem.id, CatalogItem.image_blob) \
+            .filter(CatalogItem.image_blob.isnot(None)) \
+            .order_by(CatalogItem.id) \
+            .limit(batch_size) \
+            .all()
+
+        if not items:
+            break
+
+        for item in items:
+            db_session.query(CatalogItem) \
+                .filter_by(id=item.id) \
+                .update({'image_key': image_store.save(bytes(item.image_blob)),
+                         'image_blob': None}, synchronize_session=False)
+
+        db_session.commit()
+        migrated += len(items)
+        print('Migrated {0} images...'.format(migrated))
+
+    db_session.close()
+
+    if vacuum:
+        # VACUUM can't run inside a transaction on PostgreSQL.
+        with engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT') \
+                .execute('VACUUM')
+
+    return migrated
+
+
+def generate_all_variants(engine, image_processor):
+    """Creates missing resized variants for every image used by an item,
+    e.g. images uploaded before variants existed.
+
+    Args:
+        engine: Engine connected to the catalog database.
+        image_processor: ImageProcessor generating the variants.
+
+    Returns:
+        Number of images for which variants were generated.
+    """
+
+    db_session = sessionmaker(bind=engine)()
+    image_keys = db_session.query(CatalogItem.image_key) \
+        .filter(CatalogItem.image_key.isnot(None)) \
+        .distinct()
+
+    futures = [image_processor.submit(row.image_key) for row in image_keys]
+    db_session.close()
+
+    image_processor.shutdown(wait=True)
+
+    return len([future for future in futures if future.result()])
+
+
+def rebuild_category_counts(engine):
+    """Recomputes every category's cached item count from the items table,
+    e.g. after items were changed outside of the application. The catalog
+    version is bumped in the same transaction, so cached pages and exports
+    showing the old counts stop being served.
+
+    Args:
+        engine: Engine or connection to the catalog database.
+
+    Returns:
+        Number of categories updated.
+    """
+
+    item_count = select([func.count(CatalogItem.id)]) \
+        .where(CatalogItem.category_id == Category.id) \
+        .as_scalar()
+
+    # Connecting from a connection joins its transaction, if it's in one.
+    connection = engine.connect()
+    try:
+        with connection.begin():
+            connection.execute(CatalogVersion.bump())
+            return connection.execute(Category.__table__.update().values(
+                item_count=item_count)).rowcount
+    finally:
+        connection.close()
+
+
+def rebuild_search_index(engine):
+    """Rebuilds full-text search index of items from the items table. Only
+    SQLite's index needs rebuilding; PostgreSQL keeps its index up to date.
+
+    Args:
+        engine: Engine or connection to the catalog database.
+    """
+
+    if engine.dialect.name != 'sqlite':
+        return
+
+    engine.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+
+
+def prune_changes(engine, keep_days=30):
+    """Deletes changes older than keep_days from the change log. Clients
+    asking for changes since a pruned one are told to download the whole
+    catalog instead.
+
+    Args:
+        engine: Engine connected to the catalog database.
+        keep_days: Number of days for which changes are kept.
+
+    Returns:
+        Number of changes deleted.
+    """
+
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    changes = CatalogChange.__table__
+
+    with engine.begin() as connection:
+        # Earlier prunes left only later changes, so this never goes back.
+        # The latest change is always kept: change logs created before
+        # AUTOINCREMENT was declared would otherwise reuse sequence numbers
+        # on SQLite once emptied.
+        latest_seq = connection.execute(
+            select([func.max(changes.c.seq)])).scalar()
+        pruned_seq = connection.execute(
+            select([func.max(changes.c.seq)])
+            .where(changes.c.changed_at < cutoff)
+            .where(changes.c.seq < latest_seq)).scalar()
+        if pruned_seq is None:
+            return 0
+
+        connection.execute(CatalogVersion.__table__.update().values(
+            pruned_seq=pruned_seq))
+
+        return connection.execute(changes.delete().where(
+            changes.c.seq <= pruned_seq)).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser(
+        'upgrade-db',
+        help='Create the database schema, or bring an existing one up to '
+             'date.')
+
+    migrate_parser = commands.add_parser(
+        'migrate-images', help='Move item image blobs into the image store.')
+    migrate_parser.add_argument('--batch-size', type=int, default=100,
+                                help='Items migrated per transaction.')
+    migrate_parser.add_argument('--vacuum', action='store_true',
+                                help='Compact catalog.db afterwards.')
+
+    commands.add_parser(
+        'generate-variants',
+        help='Create missing resized variants of item images.')
+
+    commands.add_parser(
+        'rebuild-counts',
+        help='Recompute cached item counts of all categories.')
+
+    commands.add_parser(
+        'rebuild-search-index',
+        help='Rebuild full-text search index of items.')
+
+    commands.add_parser(
+        'purge-sessions',
+        help='Delete expired sessions from the sessions table.')
+
+    prune_parser = commands.add_parser(
+        'prune-changes', help='Delete old changes from the change log.')
+    prune_parser.add_argument('--keep-days', type=int, default=30,
+                              help='Days for which changes are kept.')
+
+    for name, help_text in [
+            ('import-catalog', 'Load users, categories and items from a file.'),
+            ('export-catalog', 'Write users, categories and items to a file.')]:
+        transfer_parser = commands.add_parser(name, help=help_text)
+        transfer_parser.add_argument('file', help='JSON Lines or CSV file.')
+        transfer_parser.add_argument('--format', choices=['jsonl', 'csv'],
+                                     help='File format; guessed from the '
+                                          'file name by default.')
+        transfer_parser.add_argument('--images',
+                                     help='Directory of image files named by '
+                                          'their image store keys.')
+        transfer_parser.add_argument('--batch-size', type=int,
+                                     default=TRANSFER_BATCH_SIZE,
+                                     help='Records per transaction or query.')
+
+    args = parser.parse_args()
+    config = load_config()
+    configure_engines(config)
+
+    if args.command is None:
+        parser.print_help()
+        return
+
+    # Every command expects an up-to-date schema.
+    engine = get_engine()
+    upgrade_db(engine)
+
+    if args.command == 'upgrade-db':
+        print('Done. Database schema is up to date.')
+    elif args.command == 'migrate-images':
+        count = migrate_images(engine, create_image_store(config),
+                               batch_size=args.batch_size, vacuum=args.vacuum)
+        print('Done. {0} images moved to the image store.'.format(count))
+    elif args.command == 'generate-variants':
+        image_processor = ImageProcessor.from_config(
+            create_image_store(config), config)
+        count = generate_all_variants(engine, image_processor)
+        print('Done. Generated variants for {0} images.'.format(count))
+    elif args.command == 'rebuild-counts':
+        count = rebuild_category_counts(engine)
+        print('Done. Rebuilt item counts of {0} categories.'.format(count))
+    elif args.command == 'rebuild-search-index':
+        rebuild_search_index(engine)
+        print('Done. Rebuilt search index.')
+    elif args.command == 'purge-sessions':
+        count = DatabaseSessionStore(engine).purge()
+        print('Done. Deleted {0} expired sessions.'.format(count))
+    elif args.command == 'prune-changes':
+        count = prune_changes(engine, args.keep_days)
+        print('Done. Deleted {0} changes.'.format(count))
+    elif args.command == 'import-catalog':
+        def report(stats):
+            print('Imported {0}...'.format(stats))
+
+        with open_records(args.file, 'r') as stream:
+            try:
+                stats = import_catalog(engine, create_image_store(config),
+                                       stream,
+                                       args.format or guess_format(args.file),
+                                       images_dir=args.images,
+                                       batch_size=args.batch_size,
+                                       progress=report)
+            except ValueError as error:
+                sys.exit('Import stopped at {0}'.format(error))
+            finally:
+                # Items are written straight to the table, so the cached
+                # counts are recomputed once for everything imported.
+                rebuild_category_counts(engine)
+
+        print('Done. Imported {0}.'.format(stats))
+        if stats.missing_images:
+            print('{0} item images weren\'t found and were left out.'.format(
+                stats.missing_images))
+        if stats.images:
+            print('Run generate-variants to create resized images.')
+    elif args.command == 'export-catalog':
+        with open_records(args.file, 'w') as stream:
+            stats = export_catalog(engine, create_image_store(config), stream,
+                                   args.format or guess_format(args.file),
+                                   images_dir=args.images,
+                                   batch_size=args.batch_size)
+
+        print('Done. Exported {0}.'.format(stats))
+
+
+if __name__ == '__main__':
+    main()
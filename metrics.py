@@ -0,0 +1,185 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Default upper bounds of histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = ['{0}="{1}"'.format(name, escape_label_value(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{0}="{1}"'.format(*extra))
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Base class of metrics with a value per combination of label values.
+
+    Attributes:
+        name: Name of metric.
+        description: Help text describing metric.
+        label_names: Names of labels distinguishing values of metric.
+    """
+
+    metric_type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError('{0} takes labels {1}, not {2}'.format(
+                self.name, ', '.join(self.label_names), ', '.join(labels)))
+
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        """Returns metric in the Prometheus text exposition format, as a list
+        of lines."""
+
+        lines = ['# HELP {0} {1}'.format(self.name, self.description),
+                 '# TYPE {0} {1}'.format(self.name, self.metric_type)]
+
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+
+        return lines
+
+    def _render_value(self, key, value):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Metric whose values only ever increase."""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increases value of metric for the given label values."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        return ['{0}{1} {2}'.format(self.name,
+                                    format_labels(self.label_names, key),
+                                    format_value(value))]
+
+
+class Histogram(Metric):
+    """Metric counting observed values, such as durations, in buckets.
+
+    Attributes:
+        buckets: Upper bounds of buckets, in increasing order.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, description, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Records value for the given label values."""
+
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0))
+            # Counts are replaced rather than updated in place, as render
+            # reads them after releasing the lock.
+            counts = list(counts)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager observing how many seconds its block takes."""
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append('{0}_bucket{1} {2}'.format(
+                self.name,
+                format_labels(self.label_names, key,
+                              ('le', format_value(bound))),
+                cumulative))
+
+        labels = format_labels(self.label_names, key)
+        lines.append('{0}_sum{1} {2}'.format(self.name, labels,
+                                             format_value(total)))
+        lines.append('{0}_count{1} {2}'.format(self.name, labels, cumulative))
+
+        return lines
+
+
+class MetricsRegistry(object):
+    """Collection of metrics exposed together, e.g. on a /metrics endpoint.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, label_names=()):
+        """Creates and registers Counter."""
+
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(),
+                  buckets=DEFAULT_BUCKETS):
+        """Creates and registers Histogram."""
+
+        return self._register(Histogram(name, description, label_names,
+                                        buckets))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+
+        return metric
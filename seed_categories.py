@@ -1,23 +1,14 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from database_setup import Category, Base
-
-engine = create_engine('sqlite:///catalog.db')
-
-Base.metadata.bind = engine
-
-DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
-
-db_session.add(Category(name="Soccer"))
-db_session.add(Category(name="Basketball"))
-db_session.add(Category(name="Baseball"))
-db_session.add(Category(name="Frisbee"))
-db_session.add(Category(name="Snowboarding"))
-db_session.add(Category(name="Rock Climbing"))
-db_session.add(Category(name="Foosball"))
-db_session.add(Category(name="Skating"))
-db_session.add(Category(name="Hockey"))
+from catalog_helpers import bump_catalog_version, record_category_change
+from database_setup import Category, db_session
+
+# Seeds the database configured by DATABASE_URI. Categories are recorded in the
+# change log like any other change, so clients syncing the catalog see them.
+bump_catalog_version()
+
+for name in ["Soccer", "Basketball", "Baseball", "Frisbee", "Snowboarding",
+             "Rock Climbing", "Foosball", "Skating", "Hockey"]:
+    category = Category(name=name)
+    db_session.add(category)
+    record_category_change(category)
 
 db_session.commit()
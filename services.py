@@ -0,0 +1,82 @@
+from flask import current_app, json
+from werkzeug.local import LocalProxy
+
+from cache import KeyedLocks, LRUCache
+from google_auth import GoogleClient
+from image_processing import ImageProcessor
+from image_store import create_image_store
+
+
+class CatalogServices(object):
+    """Stores, caches and clients used by an application while it handles
+    requests, created from its configuration by create_app and kept in
+    app.extensions['catalog']. None of them touch the disk or the network
+    until first used.
+
+    Attributes:
+        image_store: Storage for item images.
+        image_processor: Background workers producing resized variants of
+                         uploaded images.
+        google: Pooled connections to Google for signing users in and out.
+        page_cache: Pages rendered for visitors who aren't signed in.
+        user_cache: Profiles of signed-in users, so that they aren't read
+                    from the database on every request.
+        export_cache: Catalog exports rendered at the current catalog version,
+                      kept in the content codings clients have asked for.
+        export_locks: Lock per export, held while rendering it, so that
+                      clients polling at once after a change don't all render
+                      it.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.image_store = create_image_store(config)
+        self.image_processor = ImageProcessor.from_config(self.image_store,
+                                                          config)
+        self.google = GoogleClient.from_config(config)
+        self.page_cache = LRUCache(max_entries=config['PAGE_CACHE_SIZE'],
+                                   ttl=config['PAGE_CACHE_TTL'])
+        self.user_cache = LRUCache(max_entries=config['USER_CACHE_SIZE'],
+                                   ttl=config['USER_CACHE_TTL'])
+        self.export_cache = LRUCache(max_entries=config['EXPORT_CACHE_SIZE'],
+                                     ttl=config['EXPORT_CACHE_TTL'],
+                                     max_size=config['EXPORT_CACHE_MAX_BYTES'],
+                                     sizeof=lambda export: export.size)
+        self.export_locks = KeyedLocks()
+        self._client_id = None
+
+    @property
+    def client_id(self):
+        """Google client ID of the application, read from CLIENT_SECRETS_FILE
+        the first time it's needed.
+        """
+
+        if self._client_id is None:
+            with open(self.config['CLIENT_SECRETS_FILE'], 'r') as secrets:
+                self._client_id = json.load(secrets)['web']['client_id']
+
+        return self._client_id
+
+
+def get_services():
+    """Returns CatalogServices of the current application."""
+
+    return current_app.extensions['catalog']
+
+
+def service_proxy(name):
+    """Returns proxy to the named attribute of the current application's
+    CatalogServices, so that views and helpers can use it like a module-level
+    object.
+    """
+
+    return LocalProxy(lambda: getattr(get_services(), name))
+
+
+image_store = service_proxy('image_store')
+image_processor = service_proxy('image_processor')
+google = service_proxy('google')
+page_cache = service_proxy('page_cache')
+user_cache = service_proxy('user_cache')
+export_cache = service_proxy('export_cache')
+export_locks = service_proxy('export_locks')
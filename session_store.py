@@ -0,0 +1,284 @@
+import binascii
+import os
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin, \
+    session_json_serializer
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import CallbackDict
+from werkzeug.utils import import_string
+
+from cache import LRUCache
+
+
+class SessionStore(object):
+    """Interface for server-side session storage backends. Sessions are kept
+    as serialized strings addressed by session ID, and expire ttl seconds
+    after they were last saved.
+    """
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates store instance from application configuration.
+
+        Args:
+            config: Mapping of configuration values.
+        """
+
+        raise NotImplementedError
+
+    def load(self, session_id):
+        """Retrieves session contents.
+
+        Args:
+            session_id: ID of session.
+
+        Returns:
+            Serialized session contents, or None if there is no valid session
+            with the given ID.
+        """
+
+        raise NotImplementedError
+
+    def save(self, session_id, data):
+        """Stores session contents, replacing any stored under the same ID.
+
+        Args:
+            session_id: ID of session.
+            data: Serialized session contents.
+        """
+
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Deletes session, if it exists.
+
+        Args:
+            session_id: ID of session.
+        """
+
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps sessions in memory. Sessions are lost when the process exits and
+    aren't shared between processes, so this store suits running the
+    application as a single process. Once max_entries sessions are stored, the
+    least recently used session is dropped.
+    """
+
+    def __init__(self, max_entries=10000, ttl=31 * 86400):
+        self.sessions = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_entries=config['SESSION_CACHE_SIZE'],
+                   ttl=config['PERMANENT_SESSION_LIFETIME'].total_seconds())
+
+    def load(self, session_id):
+        return self.sessions.get(session_id)
+
+    def save(self, session_id, data):
+        self.sessions.set(session_id, data)
+
+    def delete(self, session_id):
+        self.sessions.delete(session_id)
+
+
+class DatabaseSessionStore(SessionStore):
+    """Keeps sessions in the sessions table of the catalog database, so they
+    survive restarts and are shared by every application process. Expired
+    sessions are ignored, and removed by the manage.py purge-sessions command.
+    """
+
+    def __init__(self, engine=None, ttl=31 * 86400):
+        # Imported here so that the in-memory store doesn't need a database.
+        from database_setup import UserSession
+
+        self._engine = engine
+        self.table = UserSession.__table__
+        self.ttl = ttl
+
+    @property
+    def engine(self):
+        """Engine given to the store, or else the application's primary
+        engine, looked up on use so that it's only created once needed.
+        """
+
+        if self._engine is not None:
+            return self._engine
+
+        from database_setup import get_engine
+
+        return get_engine()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(ttl=config['PERMANENT_SESSION_LIFETIME'].total_seconds())
+
+    def load(self, session_id):
+        row = self.engine.execute(
+            self.table.select()
+            .with_only_columns([self.table.c.data])
+            .where(self.table.c.id == session_id)
+            .where(self.table.c.expires_at > datetime.utcnow())).first()
+
+        return row.data if row is not None else None
+
+    def save(self, session_id, data):
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                self.table.update()
+                .where(self.table.c.id == session_id)
+                .values(data=data, expires_at=expires_at))
+            if result.rowcount:
+                return
+
+            try:
+                connection.execute(self.table.insert().values(
+                    id=session_id, data=data, expires_at=expires_at))
+            except IntegrityError:
+                # Another request created the session first; a session is
+                # only ever saved by requests from the same browser, so the
+                # last save wins as with the update above.
+                connection.execute(
+                    self.table.update()
+                    .where(self.table.c.id == session_id)
+                    .values(data=data, expires_at=expires_at))
+
+    def delete(self, session_id):
+        self.engine.execute(
+            self.table.delete().where(self.table.c.id == session_id))
+
+    def purge(self):
+        """Deletes expired sessions.
+
+        Returns:
+            Number of sessions deleted.
+        """
+
+        return self.engine.execute(
+            self.table.delete()
+            .where(self.table.c.expires_at <= datetime.utcnow())).rowcount
+
+
+def create_session_store(config):
+    """Creates session store using backend class named by the SESSION_BACKEND
+    configuration value.
+
+    Args:
+        config: Mapping of configuration values.
+
+    Returns:
+        SessionStore instance.
+    """
+
+    backend = import_string(config['SESSION_BACKEND'])
+
+    return backend.from_config(config)
+
+
+def generate_session_id():
+    return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session whose contents are kept in a SessionStore.
+
+    Attributes:
+        sid: ID of session, sent to the browser as the session cookie.
+        new: True if session didn't exist before this request.
+        modified: True if contents changed during this request.
+        accessed: True if contents were read or changed during this request.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid or generate_session_id()
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.replaced_sid = None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(ServerSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(ServerSession, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super(ServerSession, self).setdefault(key, default)
+
+    def regenerate(self):
+        """Moves contents to a new session ID, discarding the old one. Called
+        when a user signs in, so that an ID planted in the browser beforehand
+        can't be used to hijack the signed-in session.
+        """
+
+        if self.replaced_sid is None and not self.new:
+            self.replaced_sid = self.sid
+        self.sid = generate_session_id()
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface keeping session contents in a SessionStore.
+    The session cookie holds only the session ID, and is only sent when the
+    ID changes, instead of the whole signed session on every response.
+
+    Attributes:
+        store: SessionStore holding the sessions.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(self.serializer.loads(data), sid=sid)
+
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Responses depending on the session differ from visitor to visitor,
+        # so shared caches must not serve them to anyone else.
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)))
+
+        if session.new or session.replaced_sid is not None:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
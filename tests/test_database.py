@@ -0,0 +1,190 @@
+"""Tests of the database layer: SQLite connections in WAL mode, routing of
+reads to a read replica, and item search on both supported databases.
+
+The PostgreSQL tests run only if TEST_POSTGRESQL_URI is set to the URL of a
+scratch database, whose tables they drop and create again.
+
+Usage:
+    python -m unittest discover tests
+"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+import config
+from application import create_app
+from catalog_helpers import POSTGRESQL_SEARCH_SQL, build_match_expression, \
+    build_tsquery_expression, search_items
+from catalog_transfer import import_catalog
+from database_setup import Category, configure_engines, create_db_engine, \
+    db_session, get_engine
+from manage import schema_migrations, upgrade_db
+
+RECORDS = [
+    {'type': 'category', 'id': 1, 'name': 'Soccer'},
+    {'type': 'item', 'id': 1, 'category_id': 1, 'name': 'Ball',
+     'description': 'Size 5 match ball.'},
+    {'type': 'item', 'id': 2, 'category_id': 1, 'name': 'Shin guards',
+     'description': 'Keep a ball from hurting.'},
+]
+
+
+def import_records(app, engine):
+    """Imports RECORDS into the database of engine."""
+
+    stream = io.StringIO(u''.join(json.dumps(record) + u'\n'
+                                  for record in RECORDS))
+    import_catalog(engine, app.extensions['catalog'].image_store, stream,
+                   'jsonl')
+
+
+def category_names(engine):
+    return [row.name for row in engine.execute(
+        select([Category.name]).order_by(Category.id))]
+
+
+class SearchExpressionTest(unittest.TestCase):
+
+    def test_match_expression_quotes_words(self):
+        self.assertEqual(build_match_expression('red "ball'),
+                         '"red" """ball"*')
+        self.assertIsNone(build_match_expression('   '))
+
+    def test_tsquery_expression_keeps_only_words(self):
+        self.assertEqual(build_tsquery_expression("red ball's & (!"),
+                         'red & ball & s:*')
+        self.assertIsNone(build_tsquery_expression('&|!'))
+
+    def test_postgresql_search_compiles(self):
+        statement = str(POSTGRESQL_SEARCH_SQL.compile(
+            dialect=postgresql.dialect()))
+        self.assertIn("to_tsquery('english', %(match)s)", statement)
+
+
+class SQLiteReplicaTest(unittest.TestCase):
+    """Runs the application against a primary SQLite database and a replica
+    holding different categories, so that it can be told which one a query
+    went to.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.urls = {}
+        for name in ('primary', 'replica'):
+            url = 'sqlite:///' + os.path.join(self.directory, name + '.db')
+            engine = create_db_engine(url)
+            upgrade_db(engine)
+            engine.execute(Category.__table__.insert(), name=name)
+            engine.dispose()
+            self.urls[name] = url
+
+        self.app = create_app({
+            'DATABASE_URI': self.urls['primary'],
+            'DATABASE_REPLICA_URI': self.urls['replica'],
+            'IMAGE_STORE_PATH': os.path.join(self.directory, 'images'),
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db_session.remove()
+        configure_engines(vars(config))
+        shutil.rmtree(self.directory)
+
+    def test_connections_use_wal(self):
+        with get_engine().connect() as connection:
+            self.assertEqual(
+                connection.execute('PRAGMA journal_mode').scalar(), 'wal')
+
+    def test_reads_go_to_replica(self):
+        response = self.client.get('/catalog.json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([category['name'] for category
+                          in json.loads(response.data)['catalog']],
+                         ['replica'])
+
+    def test_writes_go_to_primary(self):
+        with self.app.app_context():
+            db_session.info['read_only'] = True
+            db_session.add(Category(name='written'))
+            db_session.commit()
+
+        self.assertEqual(category_names(create_db_engine(self.urls['primary'])),
+                         ['primary', 'written'])
+        self.assertEqual(category_names(create_db_engine(self.urls['replica'])),
+                         ['replica'])
+
+    def test_recent_writers_read_from_primary(self):
+        with self.client.session_transaction() as session:
+            session['primary_until'] = 2 ** 31
+
+        response = self.client.get('/catalog.json')
+
+        self.assertEqual([category['name'] for category
+                          in json.loads(response.data)['catalog']],
+                         ['primary'])
+
+    def test_search(self):
+        import_records(self.app, get_engine())
+
+        with self.app.app_context():
+            results, has_more = search_items('bal')
+
+        self.assertEqual([row.name for row in results],
+                         ['Ball', 'Shin guards'])
+        self.assertFalse(has_more)
+
+
+@unittest.skipUnless(os.environ.get('TEST_POSTGRESQL_URI'),
+                     'TEST_POSTGRESQL_URI is not set')
+class PostgreSQLTest(unittest.TestCase):
+
+    def setUp(self):
+        url = os.environ['TEST_POSTGRESQL_URI']
+        engine = create_db_engine(url)
+        Category.metadata.drop_all(engine)
+        schema_migrations.drop(engine, checkfirst=True)
+        upgrade_db(engine)
+        engine.dispose()
+
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app({
+            'DATABASE_URI': url,
+            'IMAGE_STORE_PATH': os.path.join(self.directory, 'images'),
+        })
+        import_records(self.app, get_engine())
+
+    def tearDown(self):
+        db_session.remove()
+        configure_engines(vars(config))
+        shutil.rmtree(self.directory)
+
+    def test_import_resets_id_sequences(self):
+        with self.app.app_context():
+            category = Category(name='Hockey')
+            db_session.add(category)
+            db_session.commit()
+
+            self.assertEqual(category.id, 2)
+
+    def test_search_ranks_names_higher(self):
+        with self.app.app_context():
+            results, has_more = search_items('ball')
+
+        self.assertEqual([row.name for row in results],
+                         ['Ball', 'Shin guards'])
+        self.assertFalse(has_more)
+
+
+if __name__ == '__main__':
+    unittest.main()
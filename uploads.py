@@ -0,0 +1,61 @@
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Uploads up to this many bytes are kept in memory; larger ones are spooled
+# to a temporary file.
+SPOOL_SIZE = 512 * 1024
+
+
+class UploadFile(object):
+    """Writable temporary file receiving an uploaded file as the request body
+    is parsed. Contents are hashed as they arrive, so the image store key of
+    an upload is known without reading it again, and writing more than
+    max_size bytes aborts the request.
+
+    Attributes:
+        max_size: Largest number of bytes accepted, or None for no limit.
+        size: Number of bytes written so far.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self._digest = hashlib.sha256()
+
+    @property
+    def key(self):
+        """SHA-256 hex digest of the contents written so far."""
+
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        # Bodies sent without a Content-Length aren't rejected up front, so
+        # their size is only known as they are parsed.
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+
+        self._digest.update(data)
+
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files are received into UploadFiles, limited to
+    MAX_CONTENT_LENGTH bytes each. Werkzeug already rejects requests whose
+    Content-Length exceeds MAX_CONTENT_LENGTH before reading their bodies.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return UploadFile(self.max_content_length)
@@ -1,9 +1,18 @@
-class UserProfile:
+class UserProfile(object):
     """Class for storing user-related information. Primarily to ease passing
-    user information to Jinja views.
+    user information to Jinja views. Profiles of signed-in users are cached and
+    shared between requests, so they must not be modified. Attributes live in
+    slots rather than a per-instance dictionary, which keeps the cache of
+    profiles small.
     """
 
-    def __init__(self, username=None, email=None, picture=None, logged_in=False):
+    __slots__ = ('id', 'google_id', 'username', 'email', 'picture',
+                 'logged_in')
+
+    def __init__(self, username=None, email=None, picture=None, logged_in=False,
+                 id=None, google_id=None):
+        self.id = id
+        self.google_id = google_id
         self.username = username
         self.email = email
         self.picture = picture